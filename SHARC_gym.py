@@ -30,11 +30,26 @@ For the time being, Hamiltonians of the LVC-SHARC format are supported'''
 import os
 import re
 import sys
+import math
 import shutil
 import readline
 import itertools
-from copy import deepcopy
+import hashlib
+import multiprocessing
 from itertools import combinations
+from cStringIO import StringIO
+from optparse import OptionParser
+
+import mod_wigner
+import mod_setup_init
+
+try:
+  import numpy
+except ImportError:
+  print 'The SHARC gym requires the numpy package!'
+  sys.exit(1)
+
+CM_TO_HARTREE = 1./219474.6     #4.556335252e-6 # conversion factor from cm-1 to Hartree
 
 #globally defined dictionaries used in the interactive interface
 
@@ -285,277 +300,434 @@ def read_input(input_file):
 
 # ======================================================================= #
 
-def read_hamiltonian(lvc_file):
-  #reads the given LVC Hamiltonian
-  lvc_data = readfile(lvc_file)
-  ref_hamiltonian = { 'v0' : lvc_data[0].strip() ,
-                  'states' : [ int(x) for x in lvc_data[1].split() ] }
-  ref_hamiltonian['nr_states'] = sum([ int(ref_hamiltonian['states'][x])*(x+1) for x in range(len(ref_hamiltonian['states']))])
-  print ref_hamiltonian['states'], ref_hamiltonian['nr_states']
+def value_text(x):
+  #a value of a LVC.template as written there, with a blank in place of the 
+  #sign of positive values as in the format '% .5e'
+  if x.startswith('-'):
+    return x
+  return ' ' + x
+
+# ======================================================================= #
+
+class LVCModel:
+  '''Parsed LVC Hamiltonian in the format of the LVC.template files.
+  The linear parameters are kept as structured arrays 
+  (epsilon: mult, state, value; kappa: mult, state, mode, value; 
+  lambda: mult, state1, state2, mode, value), the SOC and dipole blocks as 
+  dense complex matrices of dimension nr_states. Every value also keeps its 
+  text from the template, so that reduced models are written without loss of 
+  precision and a model that was read is written back unchanged.'''
 
   keywordlist_linear = ['epsilon', 'kappa', 'lambda']
   keywordlist_matrix = ['SOC R', 'SOC I', 'DMX R', 'DMY R', 'DMZ R', 'DMX I', 'DMY I', 'DMZ I']
+  dtypes = { 'epsilon' : [('mult',int), ('state',int), ('value',float), ('text',object)],
+             'kappa'   : [('mult',int), ('state',int), ('mode',int), ('value',float), ('text',object)],
+             'lambda'  : [('mult',int), ('state1',int), ('state2',int), ('mode',int), ('value',float), ('text',object)] }
+  formats = { 'epsilon' : '  %i   %i %s\n',
+              'kappa'   : '  %i   %i     %i %s\n',
+              'lambda'  : '  %i   %i   %i   %i %s\n' }
+
+  def __init__(self, v0='', states=[]):
+    self.v0 = v0
+    self.states = list(states)
+    self.nr_states = sum([ int(self.states[x])*(x+1) for x in range(len(self.states)) ])
+    self.linear = {}        #'epsilon', 'kappa', 'lambda' -> structured arrays
+    for keyword in self.keywordlist_linear:
+      self.linear[keyword] = numpy.zeros(0, dtype=self.dtypes[keyword])
+    self.matrices = {}      #'SOC', 'DMX', 'DMY', 'DMZ' -> complex matrices
+    self.texts = {}         #matrix keyword -> the elements as written in the template
+    self.blocks = []        #matrix keywords that are present in the template
+    self.used_modes = []
+    self.lines = None       #the template that was read, if the model is unchanged
+
+  def read(self, lvc_file):
+    #parses a LVC.template file. The first two lines have a fixed format, 
+    #all other blocks are recognized by their keyword
+    lvc_data = readfile(lvc_file)
+    self.__init__(lvc_data[0].strip(), [ int(x) for x in lvc_data[1].split() ])
+
+    line_nr = 2
+    while line_nr < len(lvc_data):
+      #For kappa and lambda, the number of elements is written below the corresponding keyword
+      #all matrix keywords have nr_states rows
+      if any( keyword in lvc_data[line_nr].lower() for keyword in self.keywordlist_linear ):
+        current_keyword = lvc_data[line_nr].lower().strip()
+        nr_entries = int(lvc_data[line_nr+1].split()[0])
+        entries = []
+        for i in range(nr_entries):
+          s = lvc_data[line_nr+2+i].split()
+          entries.append(tuple(s) + (value_text(s[-1]),))
+        self.linear[current_keyword] = numpy.array(entries, dtype=self.dtypes[current_keyword])
+        line_nr += nr_entries+2
+        continue
 
+      if any( keyword in lvc_data[line_nr].upper() for keyword in self.keywordlist_matrix ):
+        current_keyword = lvc_data[line_nr].upper().strip()
+        rows = lvc_data[line_nr+1:line_nr+1+self.nr_states]
+        text = numpy.array([ [ value_text(x) for x in row.split() ] for row in rows ], dtype=object)
+        self.set_block(current_keyword, text.astype(float), text)
+        line_nr += self.nr_states+1
+        continue
 
-  #here we just get the modes that have some coupling elements
-  #The LVC template does not contain the number of used modes per se
-  #However, we only care for the modes that actually do something
-  used_modes = []
-  for i in range(len(lvc_data)):
-    if 'kappa' in lvc_data[i]:
-      for j in range(int(lvc_data[i+1].split()[0])):
-        current_mode = int(lvc_data[i+2+j].split()[2])
-        if current_mode in used_modes:
-          continue
-        used_modes.append(current_mode)
+      line_nr += 1
 
-  for i in range(len(lvc_data)):
-    if 'lambda' in lvc_data[i]:
-      for j in range(int(lvc_data[i+1].split()[0])):
-        current_mode = int(lvc_data[i+2+j].split()[3])
-        if current_mode in used_modes:
-          continue
-        used_modes.append(current_mode)
-  used_modes.sort()
-  ref_hamiltonian['used_modes'] = used_modes
+    self.find_used_modes()
+    self.lines = lvc_data
+    return self
 
+  def set_block(self, keyword, block, text=None):
+    #stores the real or imaginary part of a matrix block. Real and imaginary 
+    #parts are assigned separately to conserve the sign of zeros
+    name, part = keyword.split()
+    if not name in self.matrices:
+      self.matrices[name] = numpy.zeros((self.nr_states, self.nr_states), dtype=complex)
+    if part == 'R':
+      self.matrices[name].real = block
+    else:
+      self.matrices[name].imag = block
+    if text is None:
+      text = numpy.array([ [ '% .7e' % x for x in row ] for row in block ], dtype=object)
+    self.texts[keyword] = text
+    if not keyword in self.blocks:
+      self.blocks.append(keyword)
+
+  def get_block(self, keyword):
+    name, part = keyword.split()
+    if part == 'R':
+      return self.matrices[name].real
+    return self.matrices[name].imag
+
+  def find_used_modes(self):
+    #The LVC template does not contain the number of used modes per se
+    #However, we only care for the modes that actually have some coupling elements
+    self.used_modes = sorted(set(self.linear['kappa']['mode'].tolist()) | set(self.linear['lambda']['mode'].tolist()))
+    return self.used_modes
+
+  def write(self, f):
+    #formats the model in the LVC.template format directly into a file handle
+    #a model that was read from a template is written back as it was read
+    if self.lines is not None:
+      f.write(''.join(self.lines))
+      return
+    f.write('%s\n' % self.v0)
+    f.write(''.join([ '%s ' % state for state in self.states ]) + '\n')
+    for keyword in self.keywordlist_linear:
+      entries = self.linear[keyword]
+      f.write('%s\n%i\n' % (keyword, len(entries)))
+      numpy.savetxt(f, entries[[ name for name in entries.dtype.names if name != 'value' ]], fmt=self.formats[keyword], delimiter='', newline='')
+    for keyword in self.keywordlist_matrix:
+      if keyword in self.blocks:
+        f.write('%s\n' % keyword)
+        f.write(''.join([ ' '.join(row) + ' \n' for row in self.texts[keyword] ]))
+
+  def __str__(self):
+    s = StringIO()
+    self.write(s)
+    return s.getvalue()
 
-  line_nr = 2 #the first two lines have a fixed format so we can read them directly
-  while line_nr < len(lvc_data):
+# ======================================================================= #
 
-  #loop over the file until a keyword is recognized. 
-  #For kappa and lambda, the number of elements is written below the corresponding keyword
-  #all other keywords have nr_states entries. All inline comments are kept
-    
+def read_hamiltonian(lvc_file):
+  #reads the given LVC Hamiltonian
+  ref_hamiltonian = LVCModel().read(lvc_file)
+  print ref_hamiltonian.states, ref_hamiltonian.nr_states
+  return ref_hamiltonian
 
-    if any( keyword in lvc_data[line_nr].lower() for keyword in keywordlist_linear ):
-      current_keyword = lvc_data[line_nr].lower().strip()
-      print current_keyword
-      line_nr += 1      
-      nr_entries = int(lvc_data[line_nr].split()[0])
-      ref_hamiltonian[current_keyword] = [ [] for x in range(nr_entries) ]
-      print nr_entries
-      for i in range(nr_entries):
-        ref_hamiltonian[current_keyword][i] = lvc_data[line_nr+1+i]#the +1 accounts for the line below the keyword
-      line_nr += nr_entries+1
-      continue
+# ======================================================================= #
 
+def reduction_tables(ref_hamiltonian, keep_states):
+  '''Builds the lookup tables that are needed to remove states from a 
+  Hamiltonian. They are built once per state combination and all parameter 
+  arrays and matrix blocks are reduced by indexing with them.
+  Arguments:
+  1 LVCModel:    reference hamiltonian
+  2 list:        states that are kept in every multiplicity, eg [[1,3],[],[2]]
 
-    if any( keyword in lvc_data[line_nr].upper() for keyword in keywordlist_matrix ):
-      current_keyword = lvc_data[line_nr].upper().strip()
-      print current_keyword
-      line_nr += 1      
-      ref_hamiltonian[current_keyword] = [ [] for x in range(ref_hamiltonian['nr_states'])]
-      for i in range(ref_hamiltonian['nr_states']):
-        ref_hamiltonian[current_keyword][i] = lvc_data[line_nr+i]
-      line_nr += ref_hamiltonian['nr_states']
-      continue
-    
-    line_nr += 1
+  Returns:
+  1 array:       renumbering table, entry [mult-1,state] contains the new 
+                 number of the state or 0 if it is removed
+  2 array:       sorted indices of the kept rows/columns of the matrix blocks'''
 
+  nr_mult = len(ref_hamiltonian.states)
+  lookup = numpy.zeros((nr_mult, max(ref_hamiltonian.states+[0])+1), dtype=int)
+  index = []
+  sum_states = 0
+  for i in range(nr_mult):
+    kept = numpy.array(keep_states[i], dtype=int)
+    lookup[i,kept] = numpy.arange(1, len(kept)+1)
+    #every state appears once for each of its 2S+1 components
+    for j in range(i+1):
+      index.append(kept-1+sum_states+j*int(ref_hamiltonian.states[i]))
+    sum_states += int(ref_hamiltonian.states[i])*(i+1)
+  index = numpy.sort(numpy.concatenate(index+[numpy.zeros(0, dtype=int)]))
 
-  return ref_hamiltonian
+  return lookup, index
 
 # ======================================================================= #
 
 def reduce_hamiltonian(ref_hamiltonian, keep_modes, keep_states): 
-  #takes the hamiltonian dictionary, a list of states and a list of modes
-  #it creates a new dictionary where all entries and matrix elements of unwanted states and modes are removed
+  #takes the hamiltonian model, a list of states and a list of modes
+  #it creates a new model where all entries and matrix elements of unwanted states and modes are removed
   #States are being renumbered in this process
 
-  keywordlist_linear = ['epsilon', 'kappa', 'lambda']
-  keywordlist_matrix = ['SOC R', 'SOC I', 'DMX R', 'DMY R', 'DMZ R', 'DMX I', 'DMY I', 'DMZ I']
-
-  adapted_hamiltonian = deepcopy(ref_hamiltonian)
-
-  #the first three can be put in a single smart function (that I dont know)
   print keep_states
-  epsilons = []
-  for i in range(len(adapted_hamiltonian['epsilon'])):
-    line = adapted_hamiltonian['epsilon'][i].split()
-    if int(line[1]) not in keep_states[int(line[0])-1]:
-      adapted_hamiltonian['epsilon'][i] = 'deleted\n'
-    else:
-      line[1] = str(keep_states[int(line[0])-1].index(int(line[1]))+1)
-      epsilons.append('  %i   %i % .5e\n' % (int(line[0]), int(line[1]), float(line[2])))
-  adapted_hamiltonian['epsilon'] = epsilons
-
-  kappas = []
-  for i in range(len(adapted_hamiltonian['kappa'])):
-    line = adapted_hamiltonian['kappa'][i].split()
-    if int(line[1]) not in keep_states[int(line[0])-1] or (int(line[2]) not in keep_modes):
-      adapted_hamiltonian['kappa'][i] = 'deleted\n'
-    else:
-      line[1] = str(keep_states[int(line[0])-1].index(int(line[1]))+1)
-      kappas.append('  %i   %i     %i % .5e\n' % (int(line[0]), int(line[1]), int(line[2]), float(line[3])))
-  adapted_hamiltonian['kappa'] = kappas
-
-  lambdas = []
-  for i in range(len(adapted_hamiltonian['lambda'])):
-    line = adapted_hamiltonian['lambda'][i].split()
-    if int(line[1]) not in keep_states[int(line[0])-1] or int(line[2]) not in keep_states[int(line[0])-1] or (int(line[3]) not in keep_modes):
-      adapted_hamiltonian['lambda'][i] = 'deleted\n'
-    else:
-      line[1] = str(keep_states[int(line[0])-1].index(int(line[1]))+1)
-      line[2] = str(keep_states[int(line[0])-1].index(int(line[2]))+1)      
-      lambdas.append('  %i   %i   %i   %i % .5e\n' % (int(line[0]), int(line[1]), int(line[2]), int(line[3]), float(line[4])))
-  adapted_hamiltonian['lambda'] = lambdas
-
-  #transform keep_states into a set of states that includes the multiplicity
-  keep_states_mn = []
-  sum_states = 0
-  for i in range(len(ref_hamiltonian['states'])):
-    for state in keep_states[i]:
-      for j in range(i+1):
-        keep_states_mn.append(state+sum_states+j*int(ref_hamiltonian['states'][i]))
-    sum_states += int(ref_hamiltonian['states'][i])
+  lookup, index = reduction_tables(ref_hamiltonian, keep_states)
+  adapted_hamiltonian = LVCModel(ref_hamiltonian.v0, [ len(x) for x in keep_states ])
+
+  state_fields = { 'epsilon' : ['state'],
+                   'kappa'   : ['state'],
+                   'lambda'  : ['state1', 'state2'] }
+  for keyword in LVCModel.keywordlist_linear:
+    entries = ref_hamiltonian.linear[keyword]
+    keep = numpy.ones(len(entries), dtype=bool)
+    if 'mode' in entries.dtype.names:
+      keep &= numpy.in1d(entries['mode'], keep_modes)
+    for field in state_fields[keyword]:
+      keep &= lookup[entries['mult']-1,entries[field]] > 0
+    entries = entries[keep]
+    for field in state_fields[keyword]:
+      entries[field] = lookup[entries['mult']-1,entries[field]]
+    adapted_hamiltonian.linear[keyword] = entries
 
   #delete unwanted matrix entries
-  for keyword in keywordlist_matrix:
-    if keyword in ref_hamiltonian.keys():
-      adapted_property = []
-      for i in range(len(adapted_hamiltonian[keyword])):
-        line = adapted_hamiltonian[keyword][i].split()
-        new_line = []
-        if i+1 not in keep_states_mn:
-          continue
-        for j in range(len(line)):
-          if j+1 in keep_states_mn:
-            new_line.append(line[j])
-        adapted_line = ''
-        for element in new_line:
-          adapted_line += '% .7e ' % float(element)
-        adapted_line += '\n'
-        adapted_property.append(adapted_line)
-      adapted_hamiltonian[keyword] = deepcopy(adapted_property)
-    
-  adapted_hamiltonian['states'] = [ len(x) for x in keep_states]
+  for keyword in ref_hamiltonian.blocks:
+    adapted_hamiltonian.set_block(keyword, ref_hamiltonian.get_block(keyword)[numpy.ix_(index,index)], ref_hamiltonian.texts[keyword][numpy.ix_(index,index)])
+  adapted_hamiltonian.find_used_modes()
 
   return adapted_hamiltonian
 
-   
-      
-    
-
 # ======================================================================= #
 def write_hamiltonian(hamiltonian, outfile): 
   #write an instance of a reduced or not reduced Hamiltonian into a new LVC template
+  try:
+    f = open(outfile, 'w', 1<<16)
+    hamiltonian.write(f)
+    f.close()
+  except IOError:
+    print 'Could not write to file %s!' % (outfile)
+    sys.exit(2)
 
-  keywordlist_linear = ['epsilon', 'kappa', 'lambda']
-  keywordlist_matrix = ['SOC R', 'SOC I', 'DMX R', 'DMY R', 'DMZ R', 'DMX I', 'DMY I', 'DMZ I']
+# ======================================================================= #
 
-  output_string = ''
-  output_string += '%s\n' % hamiltonian['v0']
-  for state in hamiltonian['states']:
-    output_string += '%s ' % state
-  output_string += '\n'
+class REDUCTION_CACHE:
+  '''Content-addressed cache of reduced Hamiltonians. A reduction is 
+  identified by the hash of the reference template together with the sorted 
+  kept modes and states. The reductions are stored as LVC.template files in 
+  the cache directory, from where they are copied into the directories of the
+  loop, so that editing a template in the loop never changes the cache. This 
+  way reruns with overlapping selections reuse the already reduced files.'''
+
+  def __init__(self, ref_hamiltonian, cache_dir):
+    self.ref_hamiltonian = ref_hamiltonian
+    self.ref_hash = hashlib.sha1(str(ref_hamiltonian)).hexdigest()
+    self.cache_dir = cache_dir
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+  def key(self, keep_modes, keep_states):
+    s = '%s %s %s' % (self.ref_hash, sorted(keep_modes), [ sorted(x) for x in keep_states ])
+    return hashlib.sha1(s).hexdigest()
+
+  def get(self, keep_modes, keep_states):
+    #returns the reduced hamiltonian and the path of its template in the cache
+    key = self.key(keep_modes, keep_states)
+    filename = os.path.join(self.cache_dir, '%s.template' % key)
+    if os.path.isfile(filename):
+      hamiltonian = LVCModel().read(filename)
+    else:
+      hamiltonian = reduce_hamiltonian(self.ref_hamiltonian, keep_modes, keep_states)
+      #write to a temporary file first, so that an interrupted run never 
+      #leaves an incomplete template in the cache
+      tmpname = '%s.%i.tmp' % (filename, os.getpid())
+      write_hamiltonian(hamiltonian, tmpname)
+      os.rename(tmpname, filename)
+    return hamiltonian, filename
+
+  def write(self, keep_modes, keep_states, outfile):
+    #places the reduced template at outfile, returns the reduced hamiltonian
+    hamiltonian, filename = self.get(keep_modes, keep_states)
+    if os.path.lexists(outfile):
+      os.remove(outfile)
+    shutil.copyfile(filename, outfile)
+    return hamiltonian
 
-  for keyword in keywordlist_linear:
-    output_string += '%s\n%i\n' % (keyword,len(hamiltonian[keyword]) )
-    for entry in hamiltonian[keyword]:
-      output_string += '%s' %entry
+# ======================================================================= #
 
+class COMBINATIONS:
+  '''Lazy and re-iterable set of mode or state combinations. The combinations
+  are only generated while iterating over the set, while their number is 
+  known beforehand.'''
 
-  for keyword in keywordlist_matrix:
-    if keyword in hamiltonian.keys():
-      output_string += '%s\n' % keyword
-      for entry in hamiltonian[keyword]:
-        output_string += '%s' %entry
-    else:
-      continue
-  
+  def __init__(self, generator, args, count):
+    self.generator = generator
+    self.args = args
+    self.count = count
+
+  def __iter__(self):
+    return self.generator(*self.args)
 
-  #print output_string
-  writefile(outfile, output_string)
+  def __len__(self):
+    return self.count
 
 # ======================================================================= #
 
-def mode_selection(sharc_gym_input, ref_hamiltonian):
+def binomial(n, k):
+  #number of subsets with k elements of a set with n elements
+  if k < 0 or k > n:
+    return 0
+  result = 1
+  for i in range(min(k, n-k)):
+    result = result*(n-i)//(i+1)
+  return result
+
+# ======================================================================= #
+
+def mode_selection(sharc_gym_input, ref_hamiltonian, molden):
   '''Performs a selection of normal modes based on various approaches.
-  After selection, a dictionary is returned which contains all to-be-performed sets of normal modes
+  After selection, a set is returned which contains all to-be-performed sets of normal modes
   Arguments: 
   1 dictionary: parsed input file
-  2 dictionary: parsed LVC hamiltonian
+  2 LVCModel:   parsed LVC hamiltonian
+  3 dictionary: parsed molden file (mod_wigner.read_molden)
   
   Returns:
-  1 dictionary:  Sets of normal modes'''
+  1 COMBINATIONS:  Sets of normal modes'''
 
 
-  final_modes = {}  
+  final_modes = COMBINATIONS(iter, ([ref_hamiltonian.used_modes],), 1)
   if 'mode_selector' in sharc_gym_input:
 
     if sharc_gym_input['mode_selector'][0].lower() == 'none':
-      final_modes['all'] = [ref_hamiltonian['used_modes']]    
       pass
 
     elif sharc_gym_input['mode_selector'][0].lower() == 'all':
       print 'Generating all possible mode combinations ordered according to the number of normal modes.'
-      final_modes = exhaustive_mode_combination(ref_hamiltonian['used_modes'], len(ref_hamiltonian['used_modes']))
+      final_modes = exhaustive_mode_combination(ref_hamiltonian.used_modes, len(ref_hamiltonian.used_modes))
 
     elif sharc_gym_input['mode_selector'][0].lower() == 'depth':
       print 'Generating all possible mode combinations up to a depth of n-%i normal modes.' % int(sharc_gym_input['mode_selector'][1])
-      final_modes = exhaustive_mode_combination(ref_hamiltonian['used_modes'], int(sharc_gym_input['mode_selector'][1])+1)
-  else:
-    final_modes['all'] = [ref_hamiltonian['used_modes']]
+      final_modes = exhaustive_mode_combination(ref_hamiltonian.used_modes, int(sharc_gym_input['mode_selector'][1])+1)
 
+    elif sharc_gym_input['mode_selector'][0].lower() in ['greedy', 'beam']:
+      width = beam_width(sharc_gym_input['mode_selector'])
+      if not 'beam_results' in sharc_gym_input:
+        print 'Starting a beam search (width %i) by removing single normal modes.' % width
+        final_modes = exhaustive_mode_combination(ref_hamiltonian.used_modes, 2)
+      else:
+        scores = {}
+        for error, removed_modes, removed_states in read_beam_results(sharc_gym_input['beam_results'][0]):
+          key = frozenset(removed_modes)
+          scores[key] = min(error, scores.get(key, error))
+        expansion = beam_expansion(scores, ref_hamiltonian.used_modes, [], width)
+        print 'Expanded the best mode combinations (beam width %i) by removing one more normal mode.' % width
+        final_modes = [ [x for x in ref_hamiltonian.used_modes if x not in removed] for removed in expansion ]
+        final_modes = COMBINATIONS(iter, (final_modes,), len(final_modes))
+
+    elif sharc_gym_input['mode_selector'][0].lower() == 'screen':
+      threshold = float(sharc_gym_input['mode_selector'][1])
+      scores = mode_importance(ref_hamiltonian, read_frequencies(molden, ref_hamiltonian))
+      keep_modes = [ x for x in ref_hamiltonian.used_modes if scores[x] >= threshold ]
+      print 'Mode importance |kappa|/omega, |lambda|/omega:'
+      for mode in ref_hamiltonian.used_modes:
+        print '  mode %3i  % .5e  %s' % (mode, scores[mode], ['removable','kept'][mode in keep_modes])
+      depth = len(ref_hamiltonian.used_modes) - len(keep_modes)
+      if len(sharc_gym_input['mode_selector']) > 2:
+        depth = min(depth, int(sharc_gym_input['mode_selector'][2]))
+      print 'Generating all combinations removing up to %i of the %i modes below the threshold %s.' % (depth, len(ref_hamiltonian.used_modes) - len(keep_modes), threshold)
+      final_modes = exhaustive_mode_combination(ref_hamiltonian.used_modes, depth+1, keep_modes)
 
-  #print final_modes
   return final_modes
   
 # ======================================================================= #
   
-def state_selection(sharc_gym_input, ref_hamiltonian):
+def state_selection(sharc_gym_input, ref_hamiltonian, molden):
   '''Performs a selection of states based on various approaches.
-  After selection, a dictionary is returned which contains all to-be-performed sets of states
+  After selection, a set is returned which contains all to-be-performed sets of states
   Arguments: 
   1 dictionary: parsed input file
-  2 dictionary: parsed LVC hamiltonian  
+  2 LVCModel:   parsed LVC hamiltonian  
+  3 dictionary: parsed molden file (mod_wigner.read_molden)
   
   Returns:
-  1 dictionary:  Sets of states'''
+  1 COMBINATIONS:  Sets of states'''
   
   keep_states = [[1,2],[],[]] #TODO
-    
-  final_states = {}
+
+  state_list = [ [] for x in range(len(ref_hamiltonian.states)) ]
+  for x in range(len(ref_hamiltonian.states)):
+    for k in range(int(ref_hamiltonian.states[x])):
+      state_list[x].append(k+1)
+  final_states = COMBINATIONS(iter, ([state_list],), 1)
   if 'state_selector' in sharc_gym_input:
 
     if sharc_gym_input['state_selector'][0].lower() == 'none':
-      state_list = [ [] for x in range(len(ref_hamiltonian['states'])) ]
-      for x in range(len(ref_hamiltonian['states'])):
-        for k in range(int(ref_hamiltonian['states'][x])):
-          state_list[x].append(k+1)
-      final_states['all'] = [state_list]
       pass
 
     elif sharc_gym_input['state_selector'][0].lower() == 'all':
       print 'Generating all possible state combinations ordered according to the number of normal states.'
-      final_states = exhaustive_state_combination(ref_hamiltonian['states'], sum([ sum(x) for x in states ]), keep_states)
+      final_states = exhaustive_state_combination(ref_hamiltonian.states, sum(ref_hamiltonian.states), keep_states)
 
     elif sharc_gym_input['state_selector'][0].lower() == 'depth':
       print 'Generating all possible state combinations up to a depth of n-%i states.' % int(sharc_gym_input['state_selector'][1])
-      final_states = exhaustive_state_combination(ref_hamiltonian['states'], int(sharc_gym_input['state_selector'][1])+1, keep_states)  
-  else:
-    state_list = [ [] for x in range(len(ref_hamiltonian['states'])) ]
-    for x in range(len(ref_hamiltonian['states'])):
-      for k in range(int(ref_hamiltonian['states'][x])):
-        state_list[x].append(k+1)
-    final_states['all'] = [state_list]
-      
-  #print final_states
+      final_states = exhaustive_state_combination(ref_hamiltonian.states, int(sharc_gym_input['state_selector'][1])+1, keep_states)  
+
+    elif sharc_gym_input['state_selector'][0].lower() in ['greedy', 'beam']:
+      width = beam_width(sharc_gym_input['state_selector'])
+      if not 'beam_results' in sharc_gym_input:
+        print 'Starting a beam search (width %i) by removing single states.' % width
+        final_states = exhaustive_state_combination(ref_hamiltonian.states, 2, keep_states)
+      else:
+        #states are handled as (multiplicity, state) pairs during the search
+        scores = {}
+        for error, removed_modes, removed_states in read_beam_results(sharc_gym_input['beam_results'][0]):
+          key = frozenset([ (i, x) for i in range(len(removed_states)) for x in removed_states[i] ])
+          scores[key] = min(error, scores.get(key, error))
+        items = [ (i, x) for i in range(len(state_list)) for x in state_list[i] ]
+        keep_items = [ (i, x) for i in range(len(keep_states)) for x in keep_states[i] ]
+        expansion = beam_expansion(scores, items, keep_items, width)
+        print 'Expanded the best state combinations (beam width %i) by removing one more state.' % width
+        final_states = [ [ [x for x in state_list[i] if not (i, x) in removed] for i in range(len(state_list)) ] for removed in expansion ]
+        final_states = COMBINATIONS(iter, (final_states,), len(final_states))
+
+    elif sharc_gym_input['state_selector'][0].lower() == 'screen':
+      threshold = float(sharc_gym_input['state_selector'][1])
+      scores = state_importance(ref_hamiltonian, read_frequencies(molden, ref_hamiltonian))
+      #the ground state is never removed
+      screen_keep_states = [ [1] if i == 0 else [] for i in range(len(state_list)) ]
+      print 'State importance |kappa|/omega, |lambda|/|dE|, |SOC|/|dE|:'
+      for i in range(len(state_list)):
+        for x in state_list[i]:
+          if scores[i,x] >= threshold or x in keep_states[i]:
+            if not x in screen_keep_states[i]:
+              screen_keep_states[i].append(x)
+          print '  mult %i state %3i  % .5e  %s' % (i+1, x, scores[i,x], ['removable','kept'][x in screen_keep_states[i]])
+      nr_removable = sum([ len(state_list[i]) - len(screen_keep_states[i]) for i in range(len(state_list)) ])
+      depth = nr_removable
+      if len(sharc_gym_input['state_selector']) > 2:
+        depth = min(depth, int(sharc_gym_input['state_selector'][2]))
+      print 'Generating all combinations removing up to %i of the %i states below the threshold %s.' % (depth, nr_removable, threshold)
+      final_states = exhaustive_state_combination(ref_hamiltonian.states, depth+1, screen_keep_states)
 
   return final_states 
 
 # ======================================================================= #
 
-def exhaustive_mode_combination(used_modes, depth):
-  #returns a dictionary containing all combinations of modes down to n-depth
-  final_modes = {}
-  for i in range(depth):
-    current_depth = len(used_modes) - i
-    final_modes['depth_%i' % i] = sub_lists(used_modes, current_depth)
-  
-  return final_modes
+def exhaustive_mode_combination(used_modes, depth, keep_modes=[]):
+  #returns a lazy set containing all combinations of modes down to n-depth
+  #modes in keep_modes are part of every combination
+  nr_iterate = len([ x for x in used_modes if not x in keep_modes ])
+  depth = min(depth, nr_iterate+1)
+  count = sum([ binomial(nr_iterate, nr_iterate-i) for i in range(depth) ])
+  return COMBINATIONS(iterate_mode_combinations, (used_modes, depth, keep_modes), count)
 
+# ======================================================================= #
+
+def iterate_mode_combinations(used_modes, depth, keep_modes=[]):
+  #yields all combinations of modes ordered by the number of removed modes
+  iterate_modes = [ x for x in used_modes if not x in keep_modes ]
+  for i in range(depth):
+    for combination in combinations(iterate_modes, len(iterate_modes)-i):
+      yield sorted(list(combination) + [ x for x in used_modes if x in keep_modes ])
 
 # ======================================================================= #
 
@@ -573,10 +745,18 @@ def exhaustive_state_combination(states, depth, keep_states):
   3 keep_states: List of lists, identical to the state combination format
   
   Returns:
-  1 dictionary:  Sets of state combinations'''
-  
-  final_states = {}
+  1 COMBINATIONS:  Sets of state combinations'''
   
+  nr_iterate = sum(states) - len([ x for i in range(len(keep_states)) for x in keep_states[i] if x <= states[i] ])
+  depth = min(depth, nr_iterate+1)
+  count = sum([ binomial(nr_iterate, nr_iterate-i) for i in range(depth) ])
+  return COMBINATIONS(iterate_state_combinations, (states, depth, keep_states), count)
+
+# ======================================================================= #
+
+def iterate_state_combinations(states, depth, keep_states):
+  #yields all state combinations ordered by the number of removed states
+
   #get a single unnested list containing all states numbered from one to max-state
   #also expand keep states corespondingly
   expand_states = [ i+1 for i in range(sum(states)) ]
@@ -584,7 +764,8 @@ def exhaustive_state_combination(states, depth, keep_states):
   sum_states = 0
   for i in range(len(keep_states)):
     for j in range(len(keep_states[i])):
-      transformed_keep_states.append(keep_states[i][j]+sum_states)
+      if keep_states[i][j] <= states[i]:
+        transformed_keep_states.append(keep_states[i][j]+sum_states)
     sum_states += states[i]
 
   #remove keep_states from the list of avilable states for which the redcution 
@@ -594,14 +775,11 @@ def exhaustive_state_combination(states, depth, keep_states):
   #generate all combinations
   for i in range(depth):
     current_depth = len(iterate_states) -i
-    tmp_lists = sub_lists(iterate_states, current_depth)
-    adapted_states = []
-    #transform list back to list of lists with unique numbering only inside
-    #the same multiplicity
-    for add_list in tmp_lists:
+    for combination in combinations(iterate_states, current_depth):
       #add keep_states again
-      for keep_state in transformed_keep_states:
-        add_list.append(keep_state)
+      add_list = list(combination) + transformed_keep_states
+      #transform list back to list of lists with unique numbering only inside
+      #the same multiplicity
       tmp = [ [] for x in range(len(states)) ]
       sum_states = 0
       state_numbers = 0
@@ -612,38 +790,349 @@ def exhaustive_state_combination(states, depth, keep_states):
             tmp[j].append(add_list[k]-state_numbers)
         tmp[j].sort()            
         state_numbers += states[j]
-      add_list = tmp
-      adapted_states.append(tmp)
+      yield tmp
 
-    final_states['depth_%i' % i ] = adapted_states
+# ======================================================================= #
 
-  return final_states
+def read_frequencies(molden, ref_hamiltonian):
+  #returns the frequencies of the [FREQ] section of a molden file in Hartree
+  #all modes of the LVC parameters need a frequency
+  freq = numpy.array(molden['freq'])*CM_TO_HARTREE
+  if ref_hamiltonian.used_modes and max(ref_hamiltonian.used_modes) > len(freq):
+    print 'The LVC template uses mode %i, but the molden file has only %i frequencies!' % (max(ref_hamiltonian.used_modes), len(freq))
+    sys.exit(1)
+  return freq
 
 # ======================================================================= #
 
-def sub_lists(my_list, depth):
-  #Generates all non-redundant subsets of elements in a given list up to order n-depth
-  subs = [list(x) for x in combinations(my_list, depth)]
-  return subs
+def mode_importance(ref_hamiltonian, freq):
+  '''Estimates the importance of each normal mode from the LVC parameters
+  before any dynamics is run. The score of a mode is the largest 
+  dimensionless displacement |kappa|/omega or coupling |lambda|/omega.
+  Arguments: 
+  1 LVCModel:   parsed LVC hamiltonian
+  2 array:      frequencies of all modes in Hartree
+  
+  Returns:
+  1 array:      score per mode number (index 0 is unused)'''
+
+  scores = numpy.zeros(len(freq)+1)
+  omega = numpy.abs(numpy.concatenate(([1.], freq)))
+  omega[omega < 1e-8] = 1e-8
+  for keyword in ['kappa', 'lambda']:
+    entries = ref_hamiltonian.linear[keyword]
+    numpy.maximum.at(scores, entries['mode'], numpy.abs(entries['value'])/omega[entries['mode']])
+  return scores
+
+# ======================================================================= #
+
+def state_importance(ref_hamiltonian, freq):
+  '''Estimates the importance of each state from the LVC parameters before 
+  any dynamics is run. The score of a state is the largest of its gradients
+  |kappa|/omega and its couplings |lambda|/|dE| and |SOC|/|dE| to all other
+  states, where dE is the difference of the vertical energies (epsilon).
+  Arguments: 
+  1 LVCModel:   parsed LVC hamiltonian
+  2 array:      frequencies of all modes in Hartree
+  
+  Returns:
+  1 array:      score per state, entry [mult-1,state] (index 0 is unused)'''
+
+  states = ref_hamiltonian.states
+  scores = numpy.zeros((len(states), max(states+[0])+1))
+  energies = numpy.zeros(scores.shape)
+  epsilon = ref_hamiltonian.linear['epsilon']
+  energies[epsilon['mult']-1,epsilon['state']] = epsilon['value']
+  omega = numpy.abs(numpy.concatenate(([1.], freq)))
+  omega[omega < 1e-8] = 1e-8
+
+  kappa = ref_hamiltonian.linear['kappa']
+  numpy.maximum.at(scores, (kappa['mult']-1,kappa['state']), numpy.abs(kappa['value'])/omega[kappa['mode']])
+
+  lam = ref_hamiltonian.linear['lambda']
+  gap = numpy.abs(energies[lam['mult']-1,lam['state1']]-energies[lam['mult']-1,lam['state2']])
+  coupling = numpy.abs(lam['value'])/numpy.maximum(gap, 1e-8)
+  numpy.maximum.at(scores, (lam['mult']-1,lam['state1']), coupling)
+  numpy.maximum.at(scores, (lam['mult']-1,lam['state2']), coupling)
+
+  if 'SOC' in ref_hamiltonian.matrices:
+    mult, state = matrix_states(states)
+    gap = numpy.abs(energies[mult,state][:,None]-energies[mult,state][None,:])
+    coupling = numpy.abs(ref_hamiltonian.matrices['SOC'])/numpy.maximum(gap, 1e-8)
+    #couplings between the components of the same state do not count
+    coupling[(mult[:,None] == mult[None,:]) & (state[:,None] == state[None,:])] = 0.
+    numpy.maximum.at(scores, (mult,state), coupling.max(axis=1))
+
+  return scores
+
+# ======================================================================= #
+
+def matrix_states(states):
+  #returns the multiplicity (starting from 0) and the state number of every 
+  #row/column of the matrix blocks, each state appears for all its components
+  mult = numpy.concatenate([ numpy.repeat(i, states[i]*(i+1)) for i in range(len(states)) ]+[numpy.zeros(0, dtype=int)]).astype(int)
+  state = numpy.concatenate([ numpy.tile(numpy.arange(1, states[i]+1), i+1) for i in range(len(states)) ]+[numpy.zeros(0, dtype=int)]).astype(int)
+  return mult, state
+
+# ======================================================================= #
+
+def fingerprint_hamiltonian(hamiltonian, tol, max_orderings=5040):
+  '''Computes a fingerprint of a (reduced) Hamiltonian that does not depend 
+  on the numbering of its states or on the signs of the states. Modes keep
+  their numbers, so that the gradients and couplings of a state are compared
+  mode by mode. The states of each multiplicity are ordered by their energy 
+  and gradients. States which cannot be distinguished this way are tried in 
+  all orders and the smallest representation of the couplings and matrix 
+  elements is taken. For each order, the sign of every state is fixed such
+  that its first nonzero coupling or matrix element to an earlier state is 
+  positive, and the signed values are compared. This way, two reductions 
+  with the same fingerprint are related by a renumbering of the states and 
+  a change of their signs. If there are more than max_orderings such orders,
+  the original numbering of the states is used for the ties, and complex 
+  phases other than signs are not considered, which can only miss 
+  equivalences. All values are rounded to multiples of tol.
+  Arguments: 
+  1 LVCModel:   reduced LVC hamiltonian
+  2 float:      tolerance for comparing parameters
+  3 int:        maximum number of orders of indistinguishable states
+  
+  Returns:
+  1 string:     fingerprint'''
+
+  def rounded(values):
+    return numpy.rint(numpy.asarray(values)/tol).astype(numpy.int64).tolist()
+
+  signature = {}
+  epsilon = hamiltonian.linear['epsilon']
+  energies = dict(zip(zip(epsilon['mult'].tolist(), epsilon['state'].tolist()), rounded(epsilon['value'])))
+  gradients = {}
+  kappa = hamiltonian.linear['kappa']
+  for mult, state, mode, value in zip(kappa['mult'].tolist(), kappa['state'].tolist(), kappa['mode'].tolist(), rounded(kappa['value'])):
+    gradients.setdefault((mult, state), []).append((mode, value))
+  #groups of states with the same signature, each in order of the signature
+  groups = []
+  for i in range(len(hamiltonian.states)):
+    for state in range(1, hamiltonian.states[i]+1):
+      signature[(i+1, state)] = (i+1, energies.get((i+1, state), 0), tuple(sorted(gradients.get((i+1, state), []))))
+    ordered = sorted(range(1, hamiltonian.states[i]+1), key=lambda state: signature[(i+1, state)])
+    for key, group in itertools.groupby(ordered, key=lambda state: signature[(i+1, state)]):
+      groups.append([ (i+1, state) for state in group ])
+
+  lam = hamiltonian.linear['lambda']
+  #the values are rounded with their sign, complex values as (real, imaginary)
+  couplings = [ ((m, state1), (m, state2), mode, (value, 0)) for m, state1, state2, mode, value in 
+                zip(lam['mult'].tolist(), lam['state1'].tolist(), lam['state2'].tolist(), lam['mode'].tolist(), rounded(lam['value'])) ]
+  row_mult, row_state = matrix_states(hamiltonian.states)
+  row_component = numpy.concatenate([ numpy.repeat(numpy.arange(i+1), hamiltonian.states[i]) for i in range(len(hamiltonian.states)) ]+[numpy.zeros(0, dtype=int)]).astype(int)
+  row_key = zip((row_mult+1).tolist(), row_state.tolist())
+  elements = []
+  for name in sorted(hamiltonian.matrices):
+    matrix = numpy.asarray(hamiltonian.matrices[name]).reshape(len(row_mult), len(row_mult))
+    real = numpy.array(rounded(matrix.real), dtype=numpy.int64).reshape(matrix.shape)
+    imag = numpy.array(rounded(matrix.imag), dtype=numpy.int64).reshape(matrix.shape)
+    rows, columns = numpy.nonzero((real != 0) | (imag != 0))
+    elements.append((name, zip(rows.tolist(), columns.tolist(), zip(real[rows, columns].tolist(), imag[rows, columns].tolist()))))
+
+  def represent(order):
+    #couplings and matrix elements with the states numbered as in order and 
+    #the signs of the states fixed
+    number = {}
+    for group in order:
+      for state in group:
+        number[state] = len(number)
+    #off-diagonal values between two states, keyed by the later state
+    links = {}
+    for state1, state2, mode, value in couplings:
+      if number[state1] != number[state2]:
+        first, last = sorted([number[state1], number[state2]])
+        links.setdefault(last, []).append((first, 0, mode, value))
+    for iname, (name, entries) in enumerate(elements):
+      for i, j, value in entries:
+        if number[row_key[i]] < number[row_key[j]]:
+          links.setdefault(number[row_key[j]], []).append((number[row_key[i]], 1, (iname, row_component[i], row_component[j]), value))
+    sign = []
+    for state in range(len(number)):
+      sign.append(1)
+      for first, kind, key, value in sorted(links.get(state, [])):
+        if value != (0, 0):
+          positive = value[0] > 0 or (value[0] == 0 and value[1] > 0)
+          sign[state] = sign[first] * (1 if positive else -1)
+          break
+    representation = [ sorted([ (tuple(sorted([number[state1], number[state2]])), mode, value[0]*sign[number[state1]]*sign[number[state2]])
+                                for state1, state2, mode, value in couplings ]) ]
+    row = [ (m, c, number[(m+1, n)]) for m, c, n in zip(row_mult.tolist(), row_component.tolist(), row_state.tolist()) ]
+    for name, entries in elements:
+      factor = [ sign[number[key]] for key in row_key ]
+      representation.append((name, sorted([ (row[i], row[j], (value[0]*factor[i]*factor[j], value[1]*factor[i]*factor[j])) 
+                                             for i, j, value in entries if row[i] <= row[j] ])))
+    return representation
+
+  orderings = 1
+  for group in groups:
+    orderings *= math.factorial(len(group))
+  if orderings > max_orderings:
+    candidates = [ groups ]
+  else:
+    candidates = itertools.product(*[ itertools.permutations(group) for group in groups ])
+  representation = min([ represent(order) for order in candidates ])
+
+  fingerprint = [ tuple(hamiltonian.states), [ signature[group[0]] for group in groups for state in group ], representation ]
+  return hashlib.sha1(repr(fingerprint)).hexdigest()
+
+# ======================================================================= #
+
+def iterate_combinations(final_modes, final_states):
+  '''Yields all pairs of mode and state combinations of the hamiltonian loop
+  one at a time, ordered according to the number of removed modes. The total 
+  number of pairs is len(final_modes)*len(final_states).'''
+
+  for mode_combination in final_modes:
+    for state_combination in final_states:
+      yield mode_combination, state_combination
+
+# ======================================================================= #
+
+def beam_width(selector):
+  #greedy is a beam search keeping only the best combination of each level
+  if selector[0].lower() == 'greedy':
+    return 1
+  if len(selector) < 2 or int(selector[1]) < 1:
+    print 'The beam selector needs a positive beam width, eg "beam 3"!'
+    sys.exit(1)
+  return int(selector[1])
+
+# ======================================================================= #
+
+def read_beam_results(analysis_file):
+  '''Reads the results of a previous step of the beam search from the output
+  of SHARC_gym_analysis.py. The directories listed in the analysis file are 
+  located via hamiltonian_loop/setup_directories of the previous step, the 
+  removed modes and states are taken from their changed_parameters file.
+  Arguments: 
+  1 string: name of the analysis file
+  
+  Returns:
+  1 list:  (total error, removed modes, removed states) for each directory'''
+
+  directories = {}
+  for line in readfile('hamiltonian_loop/setup_directories'):
+    if len(line.split()) > 0:
+      directories[os.path.basename(line.split()[0])] = line.split()[0]
+
+  results = []
+  for line in readfile(analysis_file):
+    if not line.startswith('+++'):
+      continue
+    line = line[3:].split('|')
+    try:
+      error = float(line[1])
+    except (IndexError, ValueError):
+      continue
+    name = line[0].strip()
+    if not name in directories:
+      print 'Directory %s of file %s not found in the hamiltonian loop!' % (name, analysis_file)
+      continue
+    removed_modes = []
+    removed_states = []
+    param_data = readfile('%s/changed_parameters' % directories[name])
+    for i in range(len(param_data)):
+      if 'removed_modes' in param_data[i]:
+        removed_modes = [ int(x) for x in param_data[i+1].split() ]
+      if 'Mult' in param_data[i]:
+        removed_states.append([ int(x) for x in param_data[i].split()[2:] ])
+    results.append( (error, removed_modes, removed_states) )
+
+  if results == []:
+    print 'No results found in file %s!' % analysis_file
+    sys.exit(1)
+
+  return results
 
 # ======================================================================= #
 
-def setup_first_directory(base_dir):
+def beam_expansion(scores, items, keep_items, width):
+  '''Performs one step of the beam search. The best combinations of the 
+  deepest level of the previous step are expanded by removing one additional 
+  item each. 
+  Arguments: 
+  1 dictionary: frozenset of removed items -> total error
+  2 list:       all items that can be removed
+  3 list:       items that are never removed
+  4 integer:    number of combinations that are expanded
+  
+  Returns:
+  1 list:  frozensets of removed items of the next level'''
+
+  depth = max([ len(x) for x in scores ])
+  best = sorted([ x for x in scores if len(x) == depth ], key=lambda x: scores[x])[:width]
+  for removed in best:
+    print 'Error % .6f for removing %s' % (scores[removed], sorted(removed))
+
+  expansion = []
+  for removed in best:
+    for item in items:
+      if item in removed or item in keep_items:
+        continue
+      new_removed = removed | frozenset([item])
+      if not new_removed in scores and not new_removed in expansion:
+        expansion.append(new_removed)
+
+  if expansion == []:
+    print 'Nothing left to remove, the beam search has finished.'
+    sys.exit(0)
+
+  return expansion
+
+# ======================================================================= #
+
+def setup_first_directory(molecule, modes, changed_modes=[]):
+  #samples the initial conditions and asks for the setup of the initial 
+  #calculations in the current directory. The answers are used for all other
+  #directories
   nr_init = question('How many initial conditions do you want to set up? ',int,[10])[0]
-  os.system('python2 $SHARC_GYM/mod_wigner.py -n %i  init.molden' % nr_init)
-  os.system('$SHARC_GYM/mod_setup_init.py --sharc_gym')  
+  mod_wigner.sample(molecule, modes, nr_init, 'initconds', delete_modes=changed_modes, sidecar=True)
+  INFOS = mod_setup_init.ask(True)
+  INFOS['initf'].close()
+  del INFOS['initf']
+  if INFOS['setup']:
+    INFOS = mod_setup_init.setup(INFOS, os.getcwd())
+  mod_setup_init.close_keystrokes()
+  #all other directories are set up without questions, possibly in a process
+  #pool. Existing files are overwritten as in make_directory, unless this was
+  #declined above
+  if not hasattr(mod_setup_init, 'overwrite'):
+    mod_setup_init.overwrite = True
   key_dir = os.getcwd()
 
-  return key_dir, nr_init
+  return key_dir, nr_init, INFOS
+
+# ======================================================================= #
 
+def setup_directory(task):
+  #samples the initial conditions of a directory and sets up the initial 
+  #calculations with the answers given for the key directory. Can be run in a 
+  #process pool, all paths are absolute
+  directory, nr_init, changed_modes, molecule, modes, INFOS = task
+  #sys.exit() or an interrupt in a worker would leave the pool waiting 
+  #forever, so everything is passed on as an ordinary exception
+  try:
+    os.chdir(directory)
+    mod_wigner.sample(molecule, modes, nr_init, 'initconds', delete_modes=changed_modes, sidecar=True)
+    if INFOS['setup']:
+      mod_setup_init.setup(INFOS, directory)
+  except Exception:
+    raise
+  except BaseException, error:
+    raise Exception('Setup of %s failed: %s %s' % (directory, type(error).__name__, error))
+  return directory
 
 # ======================================================================= #
 
-def setup_dynamics(ref_hamiltonian, freq, final_modes, final_states, parameters, current_loop):
+def setup_dynamics(ref_hamiltonian, molden, final_modes, final_states, parameters, current_loop, deduplicate=None, jobs=1):
 
-  all_states = [ [] for x in ref_hamiltonian['states']]  
-  for x in range(len(ref_hamiltonian['states'])):
-    for k in range(int(ref_hamiltonian['states'][x])):
+  all_states = [ [] for x in ref_hamiltonian.states]  
+  for x in range(len(ref_hamiltonian.states)):
+    for k in range(int(ref_hamiltonian.states[x])):
       all_states[x].append(k+1)
 
   print 'all_states', all_states
@@ -652,6 +1141,8 @@ def setup_dynamics(ref_hamiltonian, freq, final_modes, final_states, parameters,
   #generate the requested loop directory and sets up the files needed to proceed
   print 'Setting up the calculations...\n'
   if current_loop == 1:
+    cache = REDUCTION_CACHE(ref_hamiltonian, os.path.abspath('gym_cache'))
+    fingerprints = {}
     make_directory('hamiltonian_loop')
     os. chdir('hamiltonian_loop')
   elif current_loop == 2:
@@ -661,77 +1152,93 @@ def setup_dynamics(ref_hamiltonian, freq, final_modes, final_states, parameters,
   base_dir = os.getcwd()
   final_directories = open('setup_directories', 'w')
   write_hamiltonian(ref_hamiltonian,'LVC.template')
+  #the molecule and normal modes are read only once, removed modes are just 
+  #not sampled
+  template = molden_template(molden)
+  mod_molden(template, molden['freq_lines'], [], 'init.molden')
+  molecule, modes = mod_wigner.load('%s/init.molden' % base_dir)
  # print final_modes
 
   if current_loop == 1:
     first_dir = True
-    for key in final_modes:
-      #make_directory('%s' % key)
-      #os. chdir('%s' % key)
-      for mode_combination in final_modes['%s' % key]:       
-        changed_modes =  [x for x in ref_hamiltonian['used_modes'] if x not in mode_combination]
-        dir_string = 'mminus_'
-        for mode in changed_modes:
-          dir_string += str(mode)
-        #sys.exit()
-        for key in final_states:
-          #print final_states, key
-          for state_combination in final_states['%s' % key]:
-            all_states_diff = []
-            state_string = 'sminus'          
-            for i in range(len(all_states)):
-              print all_states, state_combination
-              changed_states = [x for x in all_states[i] if x not in state_combination[i]] 
-              state_string += '_'              
-              all_states_diff.append(changed_states)
-              if len(changed_states) != 0:         
-                for state in changed_states:
-                  state_string += str(state)
-              else:
-                state_string += '0'
-            final_dir_string = dir_string + state_string  
-                                                 
-            make_directory('%s' % final_dir_string)
-            os. chdir('%s' % final_dir_string)
-            reduced_hamiltonian = reduce_hamiltonian(ref_hamiltonian, mode_combination, state_combination)
-            write_removed_parameters(changed_modes, all_states_diff)
-            write_hamiltonian(reduced_hamiltonian, 'LVC.template') 
-            mod_molden(freq, changed_modes, 'init.molden')
-        #run the default set up scripts for the first directory. All other 
-        #directories use the KEYSTROKES files generated there
-            if first_dir:
-              key_dir, nr_init = setup_first_directory(base_dir)
-              diabatic_check = readfile('%s/ICOND_00001/run.sh' % key_dir) 
-              for line in diabatic_check:
-                if "Should do a reference overlap calculation" in line:
-                  diabat = True
-                  all_first_run = open('%s/gym_all_run_first_init.sh' % base_dir,'w')
-                  all_first_run.write('#/bin/bash\n\n')
-                  break
-                else:
-                  diabat = False
-              if os.path.isfile('%s/all_qsub_init.sh' % key_dir):
-                qsub = True
-                all_qsub = open('%s/gym_all_qsub_init.sh' % base_dir,'w')
-                all_qsub.write('#/bin/bash\n\n')
-              else:
-                qsub = False
-                all_run = open('%s/gym_all_run_init.sh' % base_dir,'w')
-                all_run.write('#/bin/bash\n\n')
-              first_dir = False
-            else:
-              os.system('python2 $SHARC_GYM/mod_wigner.py -n %i  init.molden' % nr_init)
-              os.system('$SHARC_GYM/mod_setup_init.py --sharc_gym < %s/KEYSTROKES.setup_init_gym' % key_dir)  
-            current_dir = os.getcwd()
-            if diabat:
-              all_first_run.write('cd %s/ICOND_00000\nbash run.sh\n\n' % current_dir)   
-            if qsub:
-              all_qsub.write('bash %s/all_qsub_init.sh\n\n' % current_dir)
-            else:
-              all_run.write('bash %s/all_run_init.sh\n\n' % current_dir)
-            final_directories.write('%s\n' % current_dir)
-            os. chdir('../')      #TODO this can go wrong easily  
-      #os. chdir('../')      
+    pending = []
+    for mode_combination, state_combination in iterate_combinations(final_modes, final_states):
+      changed_modes =  [x for x in ref_hamiltonian.used_modes if x not in mode_combination]
+      dir_string = 'mminus_'
+      for mode in changed_modes:
+        dir_string += str(mode)
+      all_states_diff = []
+      state_string = 'sminus'          
+      for i in range(len(all_states)):
+        changed_states = [x for x in all_states[i] if x not in state_combination[i]] 
+        state_string += '_'              
+        all_states_diff.append(changed_states)
+        if len(changed_states) != 0:         
+          for state in changed_states:
+            state_string += str(state)
+        else:
+          state_string += '0'
+      final_dir_string = dir_string + state_string  
+                                           
+      make_directory('%s' % final_dir_string)
+      os. chdir('%s' % final_dir_string)
+      write_removed_parameters(changed_modes, all_states_diff)
+      reduced_hamiltonian = cache.write(mode_combination, state_combination, 'LVC.template')
+      mod_molden(template, molden['freq_lines'], changed_modes, 'init.molden')
+      #equivalent reductions are only calculated once, the other directories 
+      #are recorded as aliases of the first one
+      if deduplicate:
+        fingerprint = fingerprint_hamiltonian(reduced_hamiltonian, deduplicate)
+        if fingerprint in fingerprints:
+          print '%s is equivalent to %s' % (final_dir_string, os.path.basename(fingerprints[fingerprint]))
+          final_directories.write('%s alias %s\n' % (os.getcwd(), fingerprints[fingerprint]))
+          os. chdir('../')
+          continue
+        fingerprints[fingerprint] = os.getcwd()
+  #run the default set up scripts for the first directory. All other 
+  #directories use the KEYSTROKES files generated there
+      if first_dir:
+        key_dir, nr_init, INFOS = setup_first_directory(molecule, modes, changed_modes)
+        diabatic_check = readfile('%s/ICOND_00001/run.sh' % key_dir) 
+        for line in diabatic_check:
+          if "Should do a reference overlap calculation" in line:
+            diabat = True
+            all_first_run = open('%s/gym_all_run_first_init.sh' % base_dir,'w')
+            all_first_run.write('#/bin/bash\n\n')
+            break
+          else:
+            diabat = False
+        if os.path.isfile('%s/all_qsub_init.sh' % key_dir):
+          qsub = True
+          all_qsub = open('%s/gym_all_qsub_init.sh' % base_dir,'w')
+          all_qsub.write('#/bin/bash\n\n')
+        else:
+          qsub = False
+          all_run = open('%s/gym_all_run_init.sh' % base_dir,'w')
+          all_run.write('#/bin/bash\n\n')
+        first_dir = False
+      elif jobs > 1:
+        pending.append( (os.getcwd(), nr_init, changed_modes, molecule, modes, INFOS) )
+      else:
+        setup_directory( (os.getcwd(), nr_init, changed_modes, molecule, modes, INFOS) )
+      current_dir = os.getcwd()
+      if diabat:
+        all_first_run.write('cd %s/ICOND_00000\nbash run.sh\n\n' % current_dir)   
+      if qsub:
+        all_qsub.write('bash %s/all_qsub_init.sh\n\n' % current_dir)
+      else:
+        all_run.write('bash %s/all_run_init.sh\n\n' % current_dir)
+      final_directories.write('%s\n' % current_dir)
+      os. chdir('../')      #TODO this can go wrong easily  
+    #all other directories only need the answers given for the key directory
+    #and are set up in parallel. The scripts above already list them in order
+    if len(pending) > 0:
+      print 'Setting up %i directories with %i processes...' % (len(pending), jobs)
+      pool = multiprocessing.Pool(jobs)
+      for directory in pool.imap_unordered(setup_directory, pending):
+        print 'Finished %s' % directory
+      pool.close()
+      pool.join()
     os. chdir('../')  
     if diabat:
       all_first_run.close()
@@ -744,8 +1251,7 @@ def setup_dynamics(ref_hamiltonian, freq, final_modes, final_states, parameters,
   elif current_loop == 2:
     reduced_hamiltonian = reduce_hamiltonian(ref_hamiltonian, final_modes, final_states)
     write_hamiltonian(reduced_hamiltonian, 'LVC.template') 
-    mod_molden(freq, [], 'init.molden')
-    key_dir, nr_init = setup_first_directory(base_dir)
+    key_dir, nr_init, INFOS = setup_first_directory(molecule, modes)
     for combination in parameters['combinations']:
       dir_string = 'traj_'
       for option in combination:
@@ -781,100 +1287,99 @@ def write_keystrokes_traj(parameters, combination, dir_string):
   '''For the parameter loop, a keystrokes file is written for every set of
   chosen options'''
   
-  keystrokes_string = ''
-  keystrokes_string += '%s\n' % parameters['rng']
-  keystrokes_string += '%f\n' % parameters['tmax']
-  keystrokes_string += '%f\n' % parameters['dtstep']
-  keystrokes_string += '%i\n' % parameters['nsubstep']
-  keystrokes_string += '%s\n' % str(parameters['kill'])
+  keystrokes = []
+  keystrokes.append('%s\n' % parameters['rng'])
+  keystrokes.append('%f\n' % parameters['tmax'])
+  keystrokes.append('%f\n' % parameters['dtstep'])
+  keystrokes.append('%i\n' % parameters['nsubstep'])
+  keystrokes.append('%s\n' % str(parameters['kill']))
   if parameters['kill']:
-    keystrokes_string += '%f\n' % parameters['killafter']
-  keystrokes_string += '%s\n' % str(combination[0])
-  keystrokes_string += '%s\n' % str(parameters['soc'])
-  keystrokes_string += '%s\n' % str(combination[1])
+    keystrokes.append('%f\n' % parameters['killafter'])
+  keystrokes.append('%s\n' % str(combination[0]))
+  keystrokes.append('%s\n' % str(parameters['soc']))
+  keystrokes.append('%s\n' % str(combination[1]))
   if combination[1] != 3:
-    keystrokes_string += 'True\n'
+    keystrokes.append('True\n')
   if combination[0]:
-    keystrokes_string += 'True\n'
-  keystrokes_string += '%s\n' % str(combination[2])  
-  keystrokes_string += '%s\n' % str(combination[3])
-  keystrokes_string += '%s\n' % str(combination[4])
-  keystrokes_string += '%s\n' % str(combination[5])
-  keystrokes_string += '%s\n' % str(parameters['force_hops'])
+    keystrokes.append('True\n')
+  keystrokes.append('%s\n' % str(combination[2]))
+  keystrokes.append('%s\n' % str(combination[3]))
+  keystrokes.append('%s\n' % str(combination[4]))
+  keystrokes.append('%s\n' % str(combination[5]))
+  keystrokes.append('%s\n' % str(parameters['force_hops']))
   if parameters['force_hops']:
-    keystrokes_string += '%s\n' % str(parameters['force_hops_dE'])
-  keystrokes_string += '%s\n' % str(parameters['scaling'])
-  keystrokes_string += '%s\n' % str(parameters['damping'])
+    keystrokes.append('%s\n' % str(parameters['force_hops_dE']))
+  keystrokes.append('%s\n' % str(parameters['scaling']))
+  keystrokes.append('%s\n' % str(parameters['damping']))
   if combination[4] == 2 or combination[2] == 2 or combination[3] == 2:
     if len(parameters['atommaskarray']) == 0:
-      keystrokes_string += 'False\n' 
+      keystrokes.append('False\n')
     else:    
-      keystrokes_string += '%s\n' % str(parameters['atommaskarray'])
+      keystrokes.append('%s\n' % str(parameters['atommaskarray']))
   if combination[0]:
-    keystrokes_string += '%s\n' % str(parameters['sel_g'])
+    keystrokes.append('%s\n' % str(parameters['sel_g']))
   if combination[0] or combination[1] == 2 or combination[2] == 3:
-    keystrokes_string += '%s\n' % str(parameters['sel_t'])
+    keystrokes.append('%s\n' % str(parameters['sel_t']))
     if parameters['sel_g'] or parameters['sel_t']:
-      keystrokes_string += '%s\n' % str(parameters['eselect'])
-  keystrokes_string += '%s\n' % str(parameters['laser'])  
+      keystrokes.append('%s\n' % str(parameters['eselect']))
+  keystrokes.append('%s\n' % str(parameters['laser']))
   if parameters['laser']:
-    keystrokes_string += '%s\n' % str(parameters['laserfile'])   
-  keystrokes_string += '%s\n' % str(parameters['pysharc'])   
-  keystrokes_string += '%s\t\t#Write output in NetCDF format\n' % str(parameters['netcdf'])
-  keystrokes_string += '%s\n' % str(parameters['write_grad'])
-  keystrokes_string += '%s\n' % str(parameters['write_NAC'])
-  keystrokes_string += '%s\n' % str(parameters['write_property2d'])
-  keystrokes_string += '%s\n' % str(parameters['write_property1d'])
-  keystrokes_string += '%s\n' % str(parameters['write_overlap'])
+    keystrokes.append('%s\n' % str(parameters['laserfile']))
+  keystrokes.append('%s\n' % str(parameters['pysharc']))
+  keystrokes.append('%s\t\t#Write output in NetCDF format\n' % str(parameters['netcdf']))
+  keystrokes.append('%s\n' % str(parameters['write_grad']))
+  keystrokes.append('%s\n' % str(parameters['write_NAC']))
+  keystrokes.append('%s\n' % str(parameters['write_property2d']))
+  keystrokes.append('%s\n' % str(parameters['write_property1d']))
+  keystrokes.append('%s\n' % str(parameters['write_overlap']))
   if len(parameters['stride']) == 1 and parameters['stride'][0] == 1:
-    keystrokes_string += 'False\n'    
+    keystrokes.append('False\n')
   else: 
-    keystrokes_string += 'True\n'    
+    keystrokes.append('True\n')
     stride_string = ''
     for entry in parameters['stride']:
       stride_string += '%s ' % str(entry) #TODO this is for sure not correct
-    keystrokes_string += '%sstride\n' % stride_string 
+    keystrokes.append('%sstride\n' % stride_string)
 
   if parameters['here']:
-    keystrokes_string += 'True\n'    
+    keystrokes.append('True\n')
   else:
-    keystrokes_string += 'False\n'    
-    keystrokes_string += '%s\n'  % parameters['copydir']
+    keystrokes.append('False\n')
+    keystrokes.append('%s\n'  % parameters['copydir'])
 
   if parameters['qsub']:
-    keystrokes_string += 'True\t\t#Generate submission script?\n'    
-    keystrokes_string += '%s\t\t#Submission command\n' %  parameters['qsubcommand']
-    keystrokes_string += '%s\n' %  parameters['proj']
+    keystrokes.append('True\t\t#Generate submission script?\n')
+    keystrokes.append('%s\t\t#Submission command\n' %  parameters['qsubcommand'])
+    keystrokes.append('%s\n' %  parameters['proj'])
   else:
-    keystrokes_string += 'False\t\t#Generate submission script?\n'
-  keystrokes_string += 'True\n'    #setup
-  keystrokes_string += 'True\n'    #overwrite
+    keystrokes.append('False\t\t#Generate submission script?\n')
+  keystrokes.append('True\n')    #setup
+  keystrokes.append('True\n')    #overwrite
    
-  writefile('%s/KEYSTROKES.setup_traj_gym' % dir_string, keystrokes_string)
+  writefile('%s/KEYSTROKES.setup_traj_gym' % dir_string, keystrokes)
 
 # ======================================================================= # 
 
-def mod_molden(moldata, delete_modes, outstring):
+def molden_template(molden):
+  #returns the lines of a molden file read by mod_wigner.read_molden as they 
+  #are written by mod_molden
+  return [ ''.join([ '%s ' % x for x in line.split() ]) + '\n' for line in molden['lines'] ]
+
+# ======================================================================= #
+
+def mod_molden(template, freq_lines, delete_modes, outstring):
+  #writes the molden template with the frequencies of delete_modes set to zero
   #delete_modes=[7]
 
-  mod=False
-  newmolden=[]
-  j=0
-  s=''
-  for i in range(len(moldata)):
-    line=moldata[i].split()
-    if mod:
-      j+=1
-      if j in delete_modes:
-        line=['0.0']
-    if '[' in moldata[i]:
-      mod=False
-    if '[FREQ]' in line:
-      mod=True
-    for k in range(len(line)):
-      s+='%s ' % line[k]
-    s+='\n'
-  writefile(outstring, s)
+  masked = dict([ (freq_lines[j-1], '0.0 \n') for j in delete_modes if 0 < j <= len(freq_lines) ])
+  try:
+    f=open(outstring, 'w', 1<<16)
+    for i, line in enumerate(template):
+      f.write(masked.get(i, line))
+    f.close()
+  except IOError:
+    print 'Could not write to file %s!' % (outstring)
+    sys.exit(2)
 
 # ======================================================================= #
 
@@ -1426,6 +1931,18 @@ def parameter_selection(states):
 
 def main():
 
+  usage='''
+SHARC_gym.py [options]
+
+Interactive script to set up the Hamiltonian or Parameter loop of the SHARC gym.
+'''
+
+  description=''
+
+  parser = OptionParser(usage=usage, description=description)
+  parser.add_option('-j', '--jobs', dest='j', type=int, nargs=1, default=1, help="Number of directories of the Hamiltonian loop that are set up in parallel (integer, default=1)")
+  (options, args) = parser.parse_args()
+
   #the keystrokes file can be used to repeat the sequence of chosen options 
   #for a repeated run of the gym via "SHARC_gym.py < KEYSTROKES.SHARC_gym"
   open_keystrokes()
@@ -1466,25 +1983,33 @@ def main():
 
   sharc_gym_input = read_input(input_file)
   ref_hamiltonian = read_hamiltonian(lvc_file)
-  freq = readfile(sharc_gym_input['molden'][0])
+  #the parsed molden file and its normal mode format are kept in gym_cache
+  mod_wigner.CACHE_DIR = os.path.abspath('gym_cache')
+  molden = mod_wigner.read_molden(sharc_gym_input['molden'][0])
 
   #set up loops and generate all subdirectories
   if current_loop == 1:
-    final_modes = mode_selection(sharc_gym_input, ref_hamiltonian)
-    final_states = state_selection(sharc_gym_input, ref_hamiltonian)
+    final_modes = mode_selection(sharc_gym_input, ref_hamiltonian, molden)
+    final_states = state_selection(sharc_gym_input, ref_hamiltonian, molden)
+    print 'The selection results in %i mode and %i state combinations (%i directories).' % (len(final_modes), len(final_states), len(final_modes)*len(final_states))
     parameters = {}
   elif current_loop == 2:
-    final_modes = ref_hamiltonian['used_modes']
-    state_list = [ [] for x in range(len(ref_hamiltonian['states'])) ]
-    for x in range(len(ref_hamiltonian['states'])):
-      for k in range(int(ref_hamiltonian['states'][x])):
+    final_modes = ref_hamiltonian.used_modes
+    state_list = [ [] for x in range(len(ref_hamiltonian.states)) ]
+    for x in range(len(ref_hamiltonian.states)):
+      for k in range(int(ref_hamiltonian.states[x])):
         state_list[x].append(k+1)    
     final_states = state_list  
-    parameters = parameter_selection(ref_hamiltonian['states'])
-  setup_dynamics(ref_hamiltonian, freq, final_modes, final_states, parameters, current_loop)
+    parameters = parameter_selection(ref_hamiltonian.states)
+  deduplicate = None
+  if 'deduplicate' in sharc_gym_input:
+    deduplicate = 1e-6
+    if len(sharc_gym_input['deduplicate']) > 0:
+      deduplicate = float(sharc_gym_input['deduplicate'][0])
+  setup_dynamics(ref_hamiltonian, molden, final_modes, final_states, parameters, current_loop, deduplicate, max(1, options.j))
   close_keystrokes()
 
 
 
-main()
-
+if __name__ == '__main__':
+  main()
@@ -208,9 +208,17 @@ It can also compute diabatic populations:
 # ======================================================================= #
 
 def read_input(input_path):
+  #returns the set up directories and a dictionary of directories that were
+  #not calculated because they are equivalent to another directory
   print [input_path]
-  setup_input = readfile(input_path)
-  return setup_input
+  setup_input = []
+  aliases = {}
+  for line in readfile(input_path):
+    if 'alias' in line.split():
+      aliases[line.split()[0]] = line.split()[2]
+    else:
+      setup_input.append(line)
+  return setup_input, aliases
 
 
 # ======================================================================= #
@@ -486,6 +494,20 @@ def  get_taverage_state_deviation(data_files, analyze_property, ref_LVC):
   
 # ======================================================================= #
 
+def add_alias_results(result_files, aliases):
+  #directories that are aliases of an equivalent directory get its results
+  alias_results = []
+  for alias in sorted(aliases):
+    for entry in result_files:
+      if entry['entry'][0] == os.path.basename(aliases[alias].rstrip('/')):
+        alias_entry = dict(entry)
+        alias_entry['entry'] = [os.path.basename(alias.rstrip('/'))]
+        alias_results.append(alias_entry)
+        break
+  return result_files + alias_results
+
+# ======================================================================= #
+
 def print_results(result_files):
   '''for now just preliminary print function'''
 
@@ -599,7 +621,7 @@ def main():
 
 
   base_dir = get_directory()
-  setup_input = read_input('%s/setup_directories' % base_dir)
+  setup_input, aliases = read_input('%s/setup_directories' % base_dir)
   ref_LVC = readfile('%s/LVC.template' %base_dir) 
 
 #  need_properties = question('Are the properties already extracted?',bool,True):  TODO 
@@ -611,6 +633,7 @@ def main():
     analyze_file = 'pop.out'
 
   result_files = run_analyzer(setup_input, analyze_file, analyze_property, ref_LVC)
+  result_files = add_alias_results(result_files, aliases)
 
 
   print_results(result_files)
@@ -32,6 +32,7 @@ import shutil
 import readline
 from copy import deepcopy
 from itertools import combinations
+import mod_excite
 
 def readfile(filename):
   try:
@@ -175,7 +176,8 @@ def write_run_data_extractor(base_dir, netcdf):
 def run_excite(setup_input):
 
 
-  directories = [ line for line in setup_input ]      
+  #directories recorded as aliases of an equivalent directory are not set up
+  directories = [ line for line in setup_input if not 'alias' in line.split() ]      
 #  if os.getcwd().split('/')[-1] == 'hamiltonian_loop':
 #    current_loop = 1
 #  elif os.getcwd().split('/')[-1] == 'parameter_loop':
@@ -200,13 +202,13 @@ def run_excite(setup_input):
       if current_loop == 1:
         os.chdir(line.split()[0])      
         key_dir = os.getcwd()  
-        os.system('$SHARC_GYM/mod_excite.py --sharc_gym')                 
+        os.system('$SHARC_GYM/mod_excite.py --sharc_gym --qmout_cache --sidecar')                 
         os.system('$SHARC_GYM/mod_setup_traj.py --sharc_gym')
         extract_output.write('#!/bin/bash\n\n')
         keystrokes_traj = readfile('%s/KEYSTROKES.setup_traj_gym' % key_dir)
       elif current_loop == 2:
         key_dir = base_dir   
-        os.system('$SHARC_GYM/mod_excite.py --sharc_gym')                         
+        os.system('$SHARC_GYM/mod_excite.py --sharc_gym --qmout_cache --sidecar')                         
         os.chdir(line.split()[0])    
         curr_dir = os.getcwd()       
         keystrokes_traj = readfile('%s/KEYSTROKES.setup_traj_gym' % directories[0].split()[0]) 
@@ -247,7 +249,7 @@ def run_excite(setup_input):
       os.chdir(line.split()[0])    
       curr_dir = os.getcwd()          
       if current_loop == 1:
-        os.system('$SHARC_GYM/mod_excite.py --sharc_gym < %s/KEYSTROKES.excite_gym' % key_dir)
+        os.system('$SHARC_GYM/mod_excite.py --sharc_gym --qmout_cache --sidecar < %s/KEYSTROKES.excite_gym' % key_dir)
         os.system('$SHARC_GYM/mod_setup_traj.py --sharc_gym < %s/KEYSTROKES.setup_traj_gym' % key_dir)        
       elif current_loop == 2:
         shutil.copyfile('%s/initconds.excited' % base_dir , '%s/initconds.excited' % curr_dir)
@@ -277,13 +279,16 @@ def run_excite(setup_input):
         #initialize pure diabatic state population
         if diab:
           if current_loop == 1:
-            qm_out = readfile('%s/ICOND_%s/QM.out' % (curr_dir,sub_dir.split('_')[-1]))
+            qmfilename = '%s/ICOND_%s/QM.out' % (curr_dir,sub_dir.split('_')[-1])
           elif current_loop == 2:
-            qm_out = readfile('%s/ICOND_%s/QM.out' % (base_dir,sub_dir.split('_')[-1]))
-          for i in range(len(qm_out)):
-            if 'Overlap matrix' in qm_out[i]:
-              state_overlap = qm_out[i+target_state+1].split()
-              break
+            qmfilename = '%s/ICOND_%s/QM.out' % (base_dir,sub_dir.split('_')[-1])
+          qm_out, flags = mod_excite.read_QMout(qmfilename)
+          #the overlap matrix has flag 6, its rows follow the line with the dimensions
+          #without it, the diabatic coefficients of this trajectory cannot be set
+          if qm_out == None or not 6 in flags:
+            print 'No overlap matrix in %s, which is needed for the diabatic initial state of %s!' % (qmfilename, entry[0])
+            sys.exit(1)
+          state_overlap = qm_out[flags[6]+target_state+1].split()
           coeff_string = ''
           for i in range(len(state_overlap)/2):
             coeff_string += '%s  %s\n' % (state_overlap[i*2], state_overlap[i*2+1])
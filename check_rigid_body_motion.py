@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+
+#******************************************
+#
+#    SHARC-GYM
+#
+#    Copyright (c) 2020 University of Vienna
+#
+#    This file is part of the SHARC-GYM.
+#
+#    SHARC-GYM is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SHARC-GYM is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    from the git repository.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************
+
+# Script to check that the batched removal of translations and rotations of
+# mod_wigner (remove_rigid_body_motion) agrees with the per-atom loops
+# (restore_center_of_mass, remove_translations, remove_rotations) and to
+# compare their timings.
+#
+# usage python check_rigid_body_motion.py [-n <NUMBER>] [-a <ATOMS>]
+
+import sys
+import time
+from optparse import OptionParser
+
+import numpy
+
+import mod_wigner
+
+# ======================================================================================================================
+
+def random_batch(amount, natom, seed):
+  #a molecule with random masses and a batch of distorted geometries and 
+  #random velocities around it, in atomic units
+  numpy.random.seed(seed)
+  mass = numpy.random.uniform(1., 20., natom)*mod_wigner.U_TO_AMU
+  equi = numpy.random.normal(0., 2., (natom, 3))
+  coord = equi + numpy.random.normal(0., 0.2, (amount, natom, 3))
+  veloc = numpy.random.normal(0., 1e-3, (amount, natom, 3))
+  molecule = [ mod_wigner.ATOM('X', 1., equi[iatom].tolist(), mass[iatom]) for iatom in range(natom) ]
+  return molecule, mass, coord, veloc
+
+# ======================================================================================================================
+
+def per_atom(molecule, coord, veloc):
+  #one initial condition after another, as without numpy
+  coord_out = numpy.zeros(coord.shape)
+  veloc_out = numpy.zeros(veloc.shape)
+  for i in range(len(coord)):
+    ic = [ mod_wigner.ATOM(atom.symb, atom.num, coord[i,iatom].tolist(), atom.mass, veloc[i,iatom].tolist()) for iatom, atom in enumerate(molecule) ]
+    mod_wigner.restore_center_of_mass(molecule, ic)
+    mod_wigner.remove_translations(ic)
+    mod_wigner.remove_rotations(ic)
+    coord_out[i] = [ atom.coord for atom in ic ]
+    veloc_out[i] = [ atom.veloc for atom in ic ]
+  return coord_out, veloc_out
+
+# ======================================================================================================================
+
+def main():
+  '''Main routine'''
+
+  usage='''
+check_rigid_body_motion.py [options]
+
+This script removes translations and rotations from a batch of random initial
+conditions once with the per-atom loops (as without numpy) and once with the
+batched projection (as used with numpy), and compares the resulting coordinates
+and velocities and the time both need. The exit code is 1 if any value differs
+by more than the tolerance relative to the largest value.
+'''
+
+  description=''
+
+  parser = OptionParser(usage=usage, description=description)
+  parser.add_option('-n', dest='n', type=int, nargs=1, default=2000, help="Number of initial conditions (integer, default=2000)")
+  parser.add_option('-a', dest='a', type=int, nargs=1, default=10, help="Number of atoms (integer, default=10)")
+  parser.add_option('-r', dest='r', type=int, nargs=1, default=16661, help="Seed for the random number generator (integer, default=16661)")
+  parser.add_option('-e', dest='e', type=float, nargs=1, default=1e-10, help="Relative tolerance (float, default=1e-10)")
+
+  (options, args) = parser.parse_args()
+  if len(args) != 0:
+    print usage
+    sys.exit(1)
+
+  molecule, mass, coord, veloc = random_batch(options.n, options.a, options.r)
+  com = mod_wigner.get_center_of_mass(molecule)
+
+  start = time.time()
+  loop = per_atom(molecule, coord, veloc)
+  time_loop = time.time()-start
+  start = time.time()
+  batch = mod_wigner.remove_rigid_body_motion(coord, veloc, mass, com)
+  time_batch = time.time()-start
+
+  print '\n  %-12s %14s %14s' % ('quantity', 'max |value|', 'max |diff|')
+  ok = True
+  for name, a, b in [ ('coord', loop[0], batch[0]), ('veloc', loop[1], batch[1]) ]:
+    scale = numpy.max(numpy.abs(a))
+    diff = numpy.max(numpy.abs(a-b))
+    print '  %-12s % 14.6e % 14.6e  %s' % (name, scale, diff, ['DIFFERENT','ok'][diff <= options.e*scale])
+    ok = ok and diff <= options.e*scale
+
+  print '\n  per-atom loops  %10.4f s' % (time_loop)
+  print '  batched         %10.4f s  (%.1f times faster)' % (time_batch, time_loop/max(time_batch, 1e-9))
+
+  if ok:
+    print '\nThe per-atom loops and the batched projection agree.'
+  else:
+    print '\nThe per-atom loops and the batched projection differ!'
+    sys.exit(1)
+
+# ======================================================================================================================
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python2
+
+#******************************************
+#
+#    SHARC-GYM
+#
+#    Copyright (c) 2020 University of Vienna
+#
+#    This file is part of the SHARC-GYM.
+#
+#    SHARC-GYM is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SHARC-GYM is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    from the git repository.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************
+
+# Script to check that the batched Wigner sampler of mod_wigner draws from the
+# same distribution as the scalar sampler (one condition after another).
+#
+# usage python check_wigner_sampling.py [-n <NUMBER>] [-t <TEMP>] <MOLDEN-FILE>
+
+import sys
+import math
+import random
+from optparse import OptionParser
+
+import numpy
+
+import mod_wigner
+
+# ======================================================================================================================
+
+def sample_scalar(amount, molecule, modes):
+  #one initial condition after another, as without numpy
+  coords = numpy.zeros((amount, len(molecule), 3))
+  velocs = numpy.zeros((amount, len(molecule), 3))
+  energies = numpy.zeros((amount, 2))
+  for i in range(amount):
+    ic = mod_wigner.sample_initial_condition(molecule, modes)
+    coords[i] = [ atom.coord for atom in ic.atomlist ]
+    velocs[i] = [ atom.veloc for atom in ic.atomlist ]
+    energies[i] = [ ic.Epot_harm, ic.Ekin ]
+  return coords, velocs, energies
+
+# ======================================================================================================================
+
+def sample_batch(amount, molecule, modes):
+  #all initial conditions at once, as written to initconds with numpy
+  coords = numpy.zeros((amount, len(molecule), 3))
+  velocs = numpy.zeros((amount, len(molecule), 3))
+  energies = numpy.zeros((amount, 2))
+  for i, ic in enumerate(mod_wigner.iterate_initial_conditions(amount, molecule, modes)):
+    coords[i] = [ atom.coord for atom in ic.atomlist ]
+    velocs[i] = [ atom.veloc for atom in ic.atomlist ]
+    energies[i] = [ ic.Epot_harm, ic.Ekin ]
+  return coords, velocs, energies
+
+# ======================================================================================================================
+
+def ks_statistic(a, b):
+  #largest distance of the empirical distribution functions of two samples
+  a = numpy.sort(a)
+  b = numpy.sort(b)
+  x = numpy.concatenate((a, b))
+  cdf_a = numpy.searchsorted(a, x, side='right')/float(len(a))
+  cdf_b = numpy.searchsorted(b, x, side='right')/float(len(b))
+  return numpy.max(numpy.abs(cdf_a-cdf_b))
+
+# ======================================================================================================================
+
+def compare(name, a, b, zmax):
+  #compares mean and standard deviation of two samples, returns False if they differ
+  n = float(len(a))
+  mean_a, mean_b = numpy.mean(a), numpy.mean(b)
+  std_a, std_b = numpy.std(a), numpy.std(b)
+  #standard errors of the mean and of the standard deviation, the latter from 
+  #the fourth moment, as the energies are far from normally distributed
+  err_std = [ math.sqrt(max(numpy.mean((x-numpy.mean(x))**4)-numpy.std(x)**4, 0.)/n)/max(2.*numpy.std(x), 1e-10) for x in [a, b] ]
+  z_mean = abs(mean_a-mean_b)/max(math.sqrt((std_a**2+std_b**2)/n), 1e-10)
+  z_std = abs(std_a-std_b)/max(math.sqrt(err_std[0]**2+err_std[1]**2), 1e-10)
+  ok = z_mean <= zmax and z_std <= zmax
+  print '  %-12s % 14.6e % 14.6e %7.2f   % 14.6e % 14.6e %7.2f  %s' % (name, mean_a, mean_b, z_mean, std_a, std_b, z_std, ['DIFFERENT','ok'][ok])
+  return ok
+
+# ======================================================================================================================
+
+def main():
+  '''Main routine'''
+
+  usage='''
+check_wigner_sampling.py [options] filename.molden
+
+This script samples initial conditions from a MOLDEN file with the scalar
+Wigner sampler (one condition after another, as without numpy) and with the
+batched sampler (as used with numpy) and compares their distributions:
+the mean and standard deviation of each Cartesian coordinate and velocity and
+of the harmonic potential and kinetic energies, and the Kolmogorov-Smirnov
+statistic of the energies. Both samplers use different random numbers, so only
+the distributions can agree. The exit code is 1 if any quantity differs.
+'''
+
+  description=''
+
+  parser = OptionParser(usage=usage, description=description)
+  parser.add_option('-n', dest='n', type=int, nargs=1, default=2000, help="Number of geometries per sampler (integer, default=2000)")
+  parser.add_option('-t', dest='t', type=float, nargs=1, default=0., help="Temperature (float, default=0.0)")
+  parser.add_option('-r', dest='r', type=int, nargs=1, default=16661, help="Seed for the random number generators (integer, default=16661)")
+  parser.add_option('-z', dest='z', type=float, nargs=1, default=5., help="Largest accepted deviation in standard errors (float, default=5.0)")
+  parser.add_option('-l', dest='l', type=float, nargs=1, default=10., help="Frequency threshold in cm^-1 (float, default=10.0)")
+
+  (options, args) = parser.parse_args()
+  if len(args) != 1:
+    print usage
+    sys.exit(1)
+
+  molecule, modes = mod_wigner.load(args[0], low_freq=options.l)
+  # the same settings as in mod_wigner.sample
+  mod_wigner.temperature = options.t
+  mod_wigner.high_temp = False
+  mod_wigner.KTR = False
+  mod_wigner.UEG = False
+  mod_wigner.UZV = False
+  random.seed(options.r)
+  numpy.random.seed(options.r)
+
+  print '\nScalar sampler ...'
+  scalar = sample_scalar(options.n, molecule, modes)
+  print 'Batched sampler ...'
+  batch = sample_batch(options.n, molecule, modes)
+
+  print '\n  %-12s %14s %14s %7s   %14s %14s %7s' % ('quantity', 'mean scalar', 'mean batch', 'z', 'std scalar', 'std batch', 'z')
+  ok = True
+  for ikey, key in enumerate(['coord', 'veloc']):
+    for iatom, atom in enumerate(molecule):
+      for xyz in range(3):
+        name = '%s %s%i %s' % (key, atom.symb, iatom+1, 'xyz'[xyz])
+        ok = compare(name, scalar[ikey][:,iatom,xyz], batch[ikey][:,iatom,xyz], options.z) and ok
+  for ienergy, name in enumerate(['Epot_harm', 'Ekin']):
+    ok = compare(name, scalar[2][:,ienergy], batch[2][:,ienergy], options.z) and ok
+
+  # critical value of the two-sample Kolmogorov-Smirnov test at 0.1% significance
+  critical = 1.95*math.sqrt(2./options.n)
+  print '\n  Kolmogorov-Smirnov statistic (critical value %.4f):' % (critical)
+  for ienergy, name in enumerate(['Epot_harm', 'Ekin']):
+    d = ks_statistic(scalar[2][:,ienergy], batch[2][:,ienergy])
+    print '  %-12s %.4f  %s' % (name, d, ['DIFFERENT','ok'][d <= critical])
+    ok = ok and d <= critical
+
+  if ok:
+    print '\nThe scalar and the batched sampler agree.'
+  else:
+    print '\nThe scalar and the batched sampler differ!'
+    sys.exit(1)
+
+# ======================================================================================================================
+
+if __name__ == '__main__':
+  main()
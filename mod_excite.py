@@ -48,6 +48,11 @@ import datetime
 from optparse import OptionParser
 import readline
 import time
+import collections
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+import mod_initconds
 
 try:
   import numpy
@@ -203,7 +208,9 @@ class INITCOND:
     self.nstate=len(statelist)
     self.Epot=self.statelist[0].e-self.eref
 
-  def init_from_file(self,f,eref,index):
+  def init_from_file(self,f,eref,index,offsets=None):
+    if offsets and index in offsets:
+      f.seek(offsets[index])
     while True: 
       line=f.readline()
       #if 'Index     %i' % (index) in line:
@@ -249,6 +256,26 @@ class INITCOND:
     else:
       self.Epot=epot_harm
 
+  def init_from_sidecar(self,data,eref,index):
+    atoms,states,epot_harm=mod_initconds.sidecar_condition(data,index)
+    atomlist=[ ATOM(symb,num,coord,mass*U_TO_AMU,veloc) for symb,num,coord,mass,veloc in atoms ]
+    statelist=[]
+    for i,e,eref_state,dip,excited in states:
+      state=STATE(i,e,eref_state,dip)
+      state.Excited=excited
+      statelist.append(state)
+    self.atomlist=atomlist
+    self.eref=eref
+    self.Epot_harm=epot_harm
+    self.natom=len(atomlist)
+    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
+    self.statelist=statelist
+    self.nstate=len(statelist)
+    if self.nstate>0:
+      self.Epot=self.statelist[0].e-self.eref
+    else:
+      self.Epot=self.Epot_harm
+
   def __str__(self):
     s='Atoms\n'
     for atom in self.atomlist:
@@ -462,7 +489,12 @@ def question(question,typefunc,default=None,autocomplete=True,ranges=False):
 # ======================================================================================================================
 # ======================================================================================================================
 
-def read_matrix(qmout,i,filename):
+def read_matrix(qmout,i,filename,asarray=False):
+  if not NONUMPY:
+    A=read_matrix_array(qmout,i,filename)
+    if A is None or asarray:
+      return A
+    return A.tolist()
   line=qmout[i].split()
   try:
     n1=int(line[0])
@@ -492,7 +524,37 @@ def read_matrix(qmout,i,filename):
 
 # =======================================
 
-def find_flag(qmout,flag,filename):
+def read_matrix_array(qmout,i,filename):
+  '''Reads the complex square matrix starting at line i of qmout at once into
+a numpy array.'''
+  line=qmout[i].split()
+  try:
+    n1=int(line[0])
+    n2=int(line[1])
+  except ValueError:
+    print 'Could not read number of states of matrix in %s' % (filename)
+    return None
+  if not n1==n2:
+    print 'Non-square matrix in %s!' % (filename)
+    return None
+  try:
+    if i+1+n1>len(qmout):
+      raise IndexError
+    A=numpy.array([ row.split()[:2*n1] for row in qmout[i+1:i+1+n1] ],dtype=float).reshape(n1,2*n1)
+  except (ValueError,IndexError):
+    print 'Matrix malformatted in %s' % (filename)
+    return None
+  # pairs of real and imaginary parts are the complex numbers
+  return A.view(complex)
+
+# =======================================
+
+def find_flag(qmout,flag,filename,flags=None):
+  if flags!=None:
+    if flag in flags:
+      return flags[flag]
+    print 'No matrix with flag %i in %s!' % (flag,filename)
+    return None
   i=0
   try:
     while not '! %i' % (flag) in qmout[i]:
@@ -504,44 +566,61 @@ def find_flag(qmout,flag,filename):
 
 # =======================================
 
-def extractQMout(filename,readP=False,readS=False):
-  '''Takes the path to a QM.out file and returns the Hamiltonian, the Dipole matrices and the property matrix'''
+def read_QMout(filename):
+  '''Reads a QM.out file in a single pass. Returns its lines and a dictionary 
+with the line number of the first "! <flag>" line of each flag, or None,None if
+the file cannot be read.'''
   try:
     qmoutf=open(filename,'r')
     qmout=qmoutf.readlines()
     qmoutf.close()
   except IOError:
     print 'Could not find %s!' % (filename)
+    return None,None
+  flags={}
+  for i,line in enumerate(qmout):
+    if line.startswith('!'):
+      s=line.split()
+      if len(s)>1 and s[0]=='!' and s[1].isdigit() and not int(s[1]) in flags:
+        flags[int(s[1])]=i
+  return qmout,flags
+
+# =======================================
+
+def extractQMout(filename,readP=False,readS=False,asarray=False):
+  '''Takes the path to a QM.out file and returns the Hamiltonian, the Dipole matrices and the property matrix (as numpy arrays if asarray)'''
+  qmout,flags=read_QMout(filename)
+  if qmout==None:
     return None,None,None,None
 
-  i=find_flag(qmout,1,filename)
+  i=find_flag(qmout,1,filename,flags)
   if i==None:
     return None,None,None,None
-  H=read_matrix(qmout,i+1,filename)
+  H=read_matrix(qmout,i+1,filename,asarray)
 
-  i=find_flag(qmout,2,filename)
+  i=find_flag(qmout,2,filename,flags)
   if i==None:
     DM=None
   else:
     #return H,None,None
     DM=[]
     for idir in range(3):
-      DM.append(read_matrix(qmout,i+1,filename))
-      if DM[-1]==None:
+      DM.append(read_matrix(qmout,i+1,filename,asarray))
+      if DM[-1] is None:
         DM=None
         break
       i+=len(DM[-1])+1
 
   if readP:
-    i=find_flag(qmout,11,filename)
+    i=find_flag(qmout,11,filename,flags)
     if i==None:
       return H,DM,None,None
-    P=read_matrix(qmout,i+1,filename)
+    P=read_matrix(qmout,i+1,filename,asarray)
   else:
     P=None
 
   if readS:
-    i=find_flag(qmout,6,filename)
+    i=find_flag(qmout,6,filename,flags)
     if i==None:
       return H,DM,P,None
     S=read_matrix(qmout,i+1,filename)
@@ -583,6 +662,56 @@ class diagonalizer:
 
 # ======================================================================================================================
 
+def transform_all(data):
+  '''transforms the H, DM and P matrices of all initial conditions in the representation where H is diagonal.
+
+data is a list of (H,DM,P,Smat) tuples (or None). All matrices of the same size are stacked into (ninit,n,n) arrays and diagonalized with a single call to eigh, the dipole and property matrices are transformed with stacked matrix products. Missing dipole or property matrices stay None.'''
+
+  groups={}
+  for icond,d in enumerate(data):
+    if d==None:
+      continue
+    key=(len(d[0]),d[1] is None,d[2] is None)
+    groups.setdefault(key,[]).append(icond)
+  for (n,noDM,noP),indices in groups.items():
+    H=numpy.array([ data[icond][0] for icond in indices ],dtype=complex)
+    eig,U=numpy.linalg.eigh(H)
+    Ucon=numpy.conj(numpy.swapaxes(U,1,2))
+    if not noDM:
+      DM=numpy.array([ data[icond][1] for icond in indices ],dtype=complex)
+      DM=numpy.matmul(Ucon[:,None],numpy.matmul(DM,U[:,None]))
+    if not noP:
+      P=numpy.array([ data[icond][2] for icond in indices ],dtype=complex)
+      P=numpy.matmul(Ucon,numpy.matmul(P,U))
+    H=numpy.zeros((len(indices),n,n),dtype=complex)
+    H[:,range(n),range(n)]=eig
+    for k,icond in enumerate(indices):
+      DMk=None
+      if not noDM:
+        DMk=DM[k]
+      Pk=None
+      if not noP:
+        Pk=P[k]
+      data[icond]=(H[k],DMk,Pk,data[icond][3])
+  return data
+
+# ======================================================================================================================
+
+def transform_stream(results,chunk=1000):
+  '''Applies transform_all to a stream of (H,DM,P,Smat) tuples (or None) in batches of chunk initial conditions and yields the transformed tuples in the same order.'''
+
+  batch=[]
+  for d in results:
+    batch.append(d)
+    if len(batch)>=chunk:
+      for d in transform_all(batch):
+        yield d
+      batch=[]
+  for d in transform_all(batch):
+    yield d
+
+# ======================================================================================================================
+
 def transform(H,DM,P):
   '''transforms the H and DM matrices in the representation where H is diagonal.'''
 
@@ -615,10 +744,9 @@ def transform(H,DM,P):
 
   else:
     eig,U=numpy.linalg.eigh(H)
-    Ucon=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
+    Ucon=numpy.conj(U.T)
     for ix in range(len(U)):
       for iy in range(len(U)):
-        Ucon[ix][iy]=U[iy][ix].conjugate()
         if ix==iy:
           H[ix][iy]=complex(eig[ix])
         else:
@@ -1048,9 +1176,15 @@ def get_initconds(INFOS):
 
   initlist=[]
   width_bar=50
+  data=mod_initconds.read_initconds_sidecar(INFOS['initf'].name,INFOS['ninit'],INFOS['natom'])
+  if not data:
+    offsets=mod_initconds.index_initconds(INFOS['initf'].name)
   for icond in range(1,INFOS['ninit']+1):
     initcond=INITCOND()
-    initcond.init_from_file(INFOS['initf'],INFOS['eref'],icond)
+    if data:
+      initcond.init_from_sidecar(data,INFOS['eref'],icond)
+    else:
+      initcond.init_from_file(INFOS['initf'],INFOS['eref'],icond,offsets)
     initlist.append(initcond)
     done=width_bar*(icond)/INFOS['ninit']
     sys.stdout.write('\r  Progress: ['+'='*done+' '*(width_bar-done)+'] %3i%%' % (done*100/width_bar))
@@ -1074,6 +1208,237 @@ def make_list(INFOS,initlist):
 
 # ======================================================================================================================
 
+def read_QMout_data(qmfilename,INFOS,asarray=False):
+  '''Reads the QM.out file of one initial condition.
+
+Returns H, DM, P (as numpy arrays if asarray) and the overlap matrix (None if not diabatizing), or None if there is no QM.out file
+or no Hamiltonian could be read from it.'''
+
+  if not os.path.isfile(qmfilename):
+    #print 'No QM.out for %s!' % (qmfilename)
+    return None
+  H,DM,P,Smat=extractQMout(qmfilename,INFOS['ion'],INFOS['diabatize'],asarray)
+  if H is None:
+    print 'No Hamiltonian in %s!' % (qmfilename)
+    return None
+  return H,DM,P,Smat
+
+# ======================================================================================================================
+
+def overlap_diabmap(Smat):
+  '''Returns the diabatic map of one initial condition, which assigns to each diabatic state the adiabatic state with an overlap of at least 0.5.'''
+
+  thres=0.5
+  #string=''
+  N=Smat[0][0].real**2
+  for i in range(len(Smat)):
+    for j in range(len(Smat[0])):
+      Smat[i][j]=Smat[i][j].real**2/N
+      #string+='%5.3f  ' % Smat[i][j]
+    #string+='\n'
+  #print string
+  Diabmap={}
+  for i in range(len(Smat)):
+    j=Smat[i].index(max(Smat[i]))
+    if Smat[i][j]>=thres:
+      Diabmap[i]=j
+  return Diabmap
+
+# ======================================================================================================================
+
+def make_estates(H,DM,P,INFOS):
+  '''Generates the list of excited states of one initial condition from its H, DM and P matrices.'''
+
+  initstate=INFOS['initstate']
+  estates=[]
+  for istate in range(len(H)):
+    if INFOS['ion']:
+      dip=[math.sqrt(abs(P[initstate][istate])),0,0]
+    else:
+      dip=[DM[i][initstate][istate] for i in range(3)]
+    estate=STATE(len(estates)+1,  H[istate][istate],  H[initstate][initstate],   dip)
+    estates.append(estate)
+  return estates
+
+# ======================================================================================================================
+
+def get_QMout_states(qmfilename,INFOS):
+  '''Reads the QM.out file of one initial condition.
+
+Returns the list of excited states and the diabatic map (None if not diabatizing), or None if there is no QM.out file.'''
+
+  data=read_QMout_data(qmfilename,INFOS)
+  if data==None:
+    return None
+  H,DM,P,Smat=data
+  if INFOS['diag']:
+    H,DM,P=transform(H,DM,P)
+  Diabmap=None
+  if INFOS['diabatize']:
+    Diabmap=overlap_diabmap(Smat)
+  return make_estates(H,DM,P,INFOS),Diabmap
+
+# ======================================================================================================================
+
+def iterate_parallel(function,arglist,jobs):
+  '''Applies function to each argument tuple of arglist in a pool of jobs threads and yields the results in the order of arglist.
+
+At most 2*jobs calls are in flight at any time, so only a bounded number of QM.out files is held in memory.'''
+
+  pool=ThreadPool(jobs)
+  window=2*jobs
+  pending=collections.deque()
+  try:
+    for args in arglist:
+      pending.append(pool.apply_async(function,args))
+      if len(pending)>=window:
+        yield pending.popleft().get()
+    while pending:
+      yield pending.popleft().get()
+  finally:
+    pool.terminate()
+    pool.join()
+
+# ======================================================================================================================
+
+def QMout_needs(INFOS):
+  '''Returns the names of the matrices of the QM.out cache which are needed with the current settings.'''
+  needs=['H']
+  if INFOS['ion']:
+    needs.append('P')
+  else:
+    needs.append('DM')
+  if INFOS['diabatize']:
+    needs.append('S')
+  return needs
+
+# ======================================================================================================================
+
+def read_QMout_cache(INFOS):
+  '''Returns the arrays of the QM.out cache <iconddir>/QMout_cache.npz,
+or None if there is none or if it was written with other settings.'''
+  filename=INFOS['iconddir']+'/QMout_cache.npz'
+  if not os.path.isfile(filename) or not zipfile.is_zipfile(filename):
+    return None
+  try:
+    f=numpy.load(filename)
+    cache=dict([ (key,f[key]) for key in f.files ])
+    f.close()
+    if bool(cache['diag'])==INFOS['diag'] and all([ key in cache for key in QMout_needs(INFOS) ]):
+      return cache
+  except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):
+    pass
+  return None
+
+# ======================================================================================================================
+
+def write_QMout_cache(INFOS,entries,filestats):
+  '''Stores the energies, (transformed) dipole or property matrices and the overlaps needed with the current settings
+in <iconddir>/QMout_cache.npz, together with size and modification time of each QM.out file.
+
+entries maps the index of an initial condition to its (H,DM,P,Smat) tuple. Conditions which lack one of the needed 
+matrices or have another number of states than the first one are not stored and are read again in the next run.
+The file is written under a temporary name and then renamed, so that an interrupted run does not leave a broken cache.'''
+  needs=QMout_needs(INFOS)
+  position={'H':0,'DM':1,'P':2,'S':3}
+  shapes={'H':(),'DM':(3,),'P':(),'S':()}
+  stored={}
+  n=None
+  for icond in sorted(entries):
+    d=entries[icond]
+    if any([ d[position[key]] is None for key in needs ]):
+      continue
+    if n==None:
+      n=len(d[0])
+    if len(d[0])==n:
+      stored[icond]=d
+  if stored=={}:
+    return
+  ninit=len(filestats)
+  cache={}
+  cache['diag']=INFOS['diag']
+  cache['size']=-numpy.ones(ninit,dtype=int)
+  cache['mtime']=numpy.zeros(ninit)
+  for key in needs:
+    if key=='H':
+      cache[key]=numpy.zeros((ninit,n),dtype=complex)
+    else:
+      cache[key]=numpy.zeros((ninit,)+shapes[key]+(n,n),dtype=complex)
+  for icond,d in stored.items():
+    cache['size'][icond]=filestats[icond][0]
+    cache['mtime'][icond]=filestats[icond][1]
+    for key in needs:
+      if key=='H':
+        cache[key][icond]=numpy.diagonal(d[0])
+      else:
+        cache[key][icond]=d[position[key]]
+  filename=INFOS['iconddir']+'/QMout_cache.npz'
+  tmpname=INFOS['iconddir']+'/QMout_cache.tmp.npz'
+  try:
+    numpy.savez(tmpname, **cache)
+    os.rename(tmpname,filename)
+  except (IOError, OSError):
+    print 'Could not write %s!' % (filename)
+    if os.path.isfile(tmpname):
+      os.remove(tmpname)
+
+# ======================================================================================================================
+
+def iterate_QMout_data(INFOS,arglist):
+  '''Yields H, DM, P (transformed if diagonalizing) and the overlap matrix for each initial condition in arglist, or None for conditions without QM.out.
+
+The data of QM.out files which did not change since the last run is taken from the QM.out cache, if there is one. The other files 
+are read (in parallel with --jobs) and diagonalized in batches while the results are yielded. Only if INFOS['qmout_cache'] is set, 
+the data is collected and the cache is written at the end.'''
+
+  cache=read_QMout_cache(INFOS)
+  filestats=[]
+  for args in arglist:
+    try:
+      filestat=os.stat(args[0])
+      filestats.append((filestat.st_size,filestat.st_mtime))
+    except OSError:
+      filestats.append((-1,0.))
+  cached=[False]*len(arglist)
+  if cache!=None:
+    for icond,filestat in enumerate(filestats):
+      if filestat[0]!=-1 and icond<len(cache['size']) and cache['size'][icond]==filestat[0] and cache['mtime'][icond]==filestat[1]:
+        cached[icond]=True
+  toread=[ icond for icond in range(len(arglist)) if filestats[icond][0]!=-1 and not cached[icond] ]
+  if cache!=None and toread==[]:
+    print 'All QM.out data taken from %s/QMout_cache.npz' % (INFOS['iconddir'])
+
+  jobs=INFOS.get('jobs',1)
+  readargs=[ arglist[icond]+(True,) for icond in toread ]
+  if jobs>1:
+    read=iterate_parallel(read_QMout_data,readargs,jobs)
+  else:
+    read=( read_QMout_data(*args) for args in readargs )
+  if INFOS['diag']:
+    read=transform_stream(read)
+
+  entries={}
+  for icond,filestat in enumerate(filestats):
+    if filestat[0]==-1:
+      d=None
+    elif cached[icond]:
+      d=[numpy.diag(cache['H'][icond]),None,None,None]
+      for i,key in [(1,'DM'),(2,'P'),(3,'S')]:
+        if key in cache:
+          d[i]=cache[key][icond]
+      d=tuple(d)
+    else:
+      d=next(read)
+      if d!=None and d[3] is not None:
+        d=d[:3]+(numpy.array(d[3]),)
+    if d!=None and INFOS.get('qmout_cache') and toread!=[]:
+      entries[icond]=d
+    yield d
+  if INFOS.get('qmout_cache') and toread!=[]:
+    write_QMout_cache(INFOS,entries,filestats)
+
+# ======================================================================================================================
+
 def get_QMout(INFOS,initlist):
   ''''''
 
@@ -1083,45 +1448,25 @@ def get_QMout(INFOS,initlist):
     global diagon
     diagon=diagonalizer()
   ncond=0
-  initstate=INFOS['initstate']
   width_bar=50
-  for icond in range(1,INFOS['ninit']+1):
-    # look for a QM.out file
-    qmfilename=INFOS['iconddir']+'/ICOND_%05i/QM.out' % (icond)
+  arglist=[ (INFOS['iconddir']+'/ICOND_%05i/QM.out' % (icond),INFOS) for icond in range(1,INFOS['ninit']+1) ]
+  jobs=INFOS.get('jobs',1)
+  if jobs>1:
+    print 'Reading with %i threads ...' % (jobs)
+  if not NONUMPY:
+    data=iterate_QMout_data(INFOS,arglist)
+    results=( None if d==None else (make_estates(d[0],d[1],d[2],INFOS),overlap_diabmap(d[3].tolist()) if INFOS['diabatize'] else None) for d in data )
+  elif jobs>1:
+    results=iterate_parallel(get_QMout_states,arglist,jobs)
+  else:
+    results=( get_QMout_states(*args) for args in arglist )
+  for icond,result in enumerate(results,1):
     done=width_bar*(icond)/INFOS['ninit']
     sys.stdout.write('\r  Progress: ['+'='*done+' '*(width_bar-done)+'] %3i%%' % (done*100/width_bar))
-    if not os.path.isfile(qmfilename):
-      #print 'No QM.out for ICOND_%05i!' % (icond)
+    if result is None:
       continue
     ncond+=1
-    H,DM,P,Smat=extractQMout(qmfilename,INFOS['ion'],INFOS['diabatize'])
-    if INFOS['diag']:
-      H,DM,P=transform(H,DM,P)
-    if INFOS['diabatize']:
-      thres=0.5
-      #string=''
-      N=Smat[0][0].real**2
-      for i in range(len(Smat)):
-        for j in range(len(Smat[0])):
-          Smat[i][j]=Smat[i][j].real**2/N
-          #string+='%5.3f  ' % Smat[i][j]
-        #string+='\n'
-      #print string
-      Diabmap={}
-      for i in range(len(Smat)):
-        j=Smat[i].index(max(Smat[i]))
-        if Smat[i][j]>=thres:
-          Diabmap[i]=j
-      #print icond,Diabmap
-    # generate list of excited states
-    estates=[]
-    for istate in range(len(H)):
-      if INFOS['ion']:
-        dip=[math.sqrt(abs(P[initstate][istate])),0,0]
-      else:
-        dip=[DM[i][initstate][istate] for i in range(3)]
-      estate=STATE(len(estates)+1,  H[istate][istate],  H[initstate][initstate],   dip)
-      estates.append(estate)
+    estates,Diabmap=result
     initlist[icond-1].addstates(estates)
     if INFOS['diabatize']:
       initlist[icond-1].Diabmap=Diabmap
@@ -1130,7 +1475,105 @@ def get_QMout(INFOS,initlist):
 
 # ======================================================================================================================
 
+def state_arrays(initlist):
+  '''Collects the excitation energies, oscillator-strength-based probabilities and excitation flags of all states into (ninit,nstates) arrays.
+
+Conditions with fewer states are padded, valid marks the existing entries.'''
+
+  nmax=max([ len(icond.statelist) for icond in initlist ]+[1])
+  valid=numpy.zeros((len(initlist),nmax),dtype=bool)
+  for i,icond in enumerate(initlist):
+    valid[i,:len(icond.statelist)]=True
+  # all states in row-major order, matching the order of valid
+  states=[ jstate for icond in initlist for jstate in icond.statelist ]
+  Eexc=numpy.zeros((len(initlist),nmax))
+  Prob=numpy.zeros((len(initlist),nmax))
+  Excited=numpy.zeros((len(initlist),nmax),dtype=bool)
+  Eexc[valid]=[ jstate.Eexc for jstate in states ]
+  Prob[valid]=[ jstate.Prob for jstate in states ]
+  Excited[valid]=[ jstate.Excited for jstate in states ]
+  return valid,Eexc,Prob,Excited
+
+# ======================================================================================================================
+
+def diabatic_map(initlist,nmax):
+  '''Converts the Diabmap dictionaries of all initial conditions into a (ninit,nmax) array.
+
+Entry [i,q] is the index of the adiabatic state corresponding to diabatic state q in condition i, or -1.'''
+
+  diabmap=-numpy.ones((len(initlist),nmax),dtype=int)
+  for i,icond in enumerate(initlist):
+    if icond.statelist==[]:
+      continue
+    for q,j in icond.Diabmap.items():
+      if q<nmax:
+        diabmap[i,q]=j
+  return diabmap
+
+# ======================================================================================================================
+
+def excite_arrays(INFOS,initlist):
+  '''Same as excite, but works on (ninit,nstates) arrays of all states.
+
+The random numbers are drawn only for the candidate states, in the same order as in excite, so that for a given seed the same states are selected.'''
+
+  emin=INFOS['erange'][0]
+  emax=INFOS['erange'][1]
+  valid,Eexc,Prob,Excited=state_arrays(initlist)
+  ninit,nmax=valid.shape
+  inrange=valid & (emin <= Eexc) & (Eexc <= emax)
+  if not INFOS['excite']==4:
+    print '\nSelecting initial states ...'
+    if INFOS['excite']==1:
+      Excited=numpy.zeros((ninit,nmax),dtype=bool)
+    elif INFOS['excite']==2:
+      allowed=numpy.zeros((ninit,nmax),dtype=bool)
+      if INFOS['diabatize']:
+        diabmap=diabatic_map(initlist,nmax)
+        for q in INFOS['allowed']:
+          if 0 < q <= nmax:
+            rows=numpy.nonzero(diabmap[:,q-1]>=0)[0]
+            allowed[rows,diabmap[rows,q-1]]=True
+      else:
+        for q in INFOS['allowed']:
+          if 0 < q <= nmax:
+            allowed[:,q-1]=True
+      Excited=inrange & allowed
+    elif INFOS['excite']==3:
+      candidate=inrange.copy()
+      for q in INFOS['allowed']:
+        if 0 < -q <= nmax:
+          candidate[:,-q-1]=False
+      maxprob=0
+      if candidate.any():
+        maxprob=max(0,Prob[candidate].max())
+      # one random number per candidate, row by row as in excite
+      r=numpy.array([ random.random() for i in range(candidate.sum()) ])
+      Excited=numpy.zeros((ninit,nmax),dtype=bool)
+      if maxprob!=0:
+        Excited[candidate]=r < Prob[candidate]/maxprob
+    Excited&=valid
+    states=[ jstate for icond in initlist for jstate in icond.statelist ]
+    flags=Excited[valid].tolist()
+    for k,jstate in enumerate(states):
+      jstate.Excited=flags[k]
+    print 'Number of initial states:                   %5i' % (Excited.sum())
+
+  # statistics
+  nexc=Excited.sum(axis=0)
+  ninrange=inrange.sum(axis=0)
+  ntotal=valid.sum(axis=0)
+  print '\nNumber of initial conditions excited:'
+  print 'State   Selected   InRange   Total'
+  for i in range(len(ntotal)):
+    print '  % 3i       % 4i      % 4i    % 4i' % (i+1,nexc[i],ninrange[i],ntotal[i])
+  return initlist
+
+# ======================================================================================================================
+
 def excite(INFOS,initlist):
+  if not NONUMPY:
+    return excite_arrays(INFOS,initlist)
   emin=INFOS['erange'][0]
   emax=INFOS['erange'][1]
   if not INFOS['excite']==4:
@@ -1262,11 +1705,21 @@ Eharm     %18.10f
   for atom in INFOS['equi']:
     string+=str(atom)+'\n'
   string+='\n\n'
+  outf.write(string)
 
+  # the conditions are written one by one instead of joining the whole file,
+  # the binary sidecar (only with --sidecar) is filled from the same text blocks
+  sidecar=None
+  if INFOS.get('sidecar'):
+    sidecar=mod_initconds.open_sidecar(outfilename,INFOS['ninit'],[ str(atom) for atom in INFOS['equi'] ],max([0]+[ icond.nstate for icond in initlist ]))
   for i,icond in enumerate(initlist):
-    string+= 'Index     %i\n%s' % (i+1, str(icond))
-  outf.write(string)
+    string=str(icond)
+    outf.write('Index     %i\n%s' % (i+1, string))
+    if sidecar:
+      sidecar.add(i+1,string)
   outf.close()
+  if sidecar:
+    sidecar.close()
 
 # ======================================================================================================================
 # ======================================================================================================================
@@ -1284,6 +1737,9 @@ information to determine which initial conditions are bright enough for a dynami
   description=''
   parser = OptionParser(usage=usage, description=description)
   parser.add_option('--sharc_gym', dest='GYM', action='store_true',help="Reduced input for SHARC_gym setups")
+  parser.add_option('-j', '--jobs', dest='jobs', type=int, nargs=1, default=1, help="Number of threads reading QM.out files in parallel (default=1)")
+  parser.add_option('--qmout_cache', dest='qmout_cache', action='store_true', default=False, help="Store the QM.out data in QMout_cache.npz in the initconds directory, so that later runs with other excitation windows do not read the QM.out files again")
+  parser.add_option('--sidecar', dest='sidecar', action='store_true', default=False, help="Also write the binary sidecar <output>.sidecar, from which the setup scripts read the initial conditions without parsing the text file")
   #parser.add_option('--no-excitation', dest='E', action='store_true',default=False,help="Sets all excitations to false.")
   #parser.add_option('--ground-state-only', dest='G', action='store_true',default=False,help="Selects the ground state of all initial conditions, and no excited states (e.g., for dynamics with laser excitation).")
   (options, args) = parser.parse_args()
@@ -1298,6 +1754,9 @@ information to determine which initial conditions are bright enough for a dynami
   #INFOS={'do_excitations': not options.E, 'ground_state_only': options.G}
   INFOS={}
   INFOS=get_infos(INFOS)
+  INFOS['jobs']=max(1,options.jobs)
+  INFOS['qmout_cache']=options.qmout_cache
+  INFOS['sidecar']=options.sidecar
 
   print '\n\n'+centerstring('Full input',60,'#')+'\n'
   for item in INFOS:
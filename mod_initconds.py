@@ -0,0 +1,258 @@
+#!/usr/bin/env python2
+
+#******************************************
+#
+#    SHARC-GYM
+#
+#    Copyright (c) 2020 University of Vienna
+#
+#    This file is part of the SHARC-GYM.
+#
+#    SHARC-GYM is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SHARC-GYM is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    from the git repository.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************
+
+# Random access to initconds files, shared by mod_wigner, mod_excite,
+# mod_setup_init and mod_setup_traj:
+# - the byte offsets of the initial conditions in <initconds>.idx
+# - the binary sidecar <initconds>.sidecar, a directory with one .npy file
+#   per field, filled condition by condition while the text file is written
+
+import os
+import shutil
+
+try:
+  import numpy
+  NONUMPY=False
+except ImportError:
+  NONUMPY=True
+
+# the fields of the sidecar, with their type and the shape of one entry
+ATOMFIELDS=[('coord',float,(3,)),('veloc',float,(3,))]
+STATEFIELDS=[('state_i',int,()),('state_e',float,()),('state_eref',float,()),('state_dip',complex,(3,)),('state_excited',bool,())]
+
+# ======================================================================================================================
+
+def index_initconds(filename):
+  '''Returns a dictionary with the byte offsets of the blocks of all initial
+conditions in an initconds file, 0 being the equilibrium geometry. The offsets
+are kept in <filename>.idx and only searched again if the size or the
+modification time of the file changed.'''
+  filestat=os.stat(filename)
+  stamp='%i %r\n' % (filestat.st_size,filestat.st_mtime)
+  idxfile=filename+'.idx'
+  try:
+    f=open(idxfile)
+    lines=f.readlines()
+    f.close()
+    if len(lines)>0 and lines[0]==stamp:
+      return dict([ (int(line.split()[0]),int(line.split()[1])) for line in lines[1:] ])
+  except (IOError, ValueError, IndexError):
+    pass
+  offsets={}
+  offset=0
+  f=open(filename)
+  while True:
+    line=f.readline()
+    if line=='':
+      break
+    s=line.split()
+    if len(s)==2 and s[0]=='Index' and s[1].isdigit():
+      offsets[int(s[1])]=offset
+    elif len(s)>0 and s[0]=='Equilibrium':
+      offsets[0]=offset
+    offset+=len(line)
+  f.close()
+  try:
+    f=open(idxfile,'w')
+    f.write(stamp)
+    for index in sorted(offsets):
+      f.write('%i %i\n' % (index,offsets[index]))
+    f.close()
+  except IOError:
+    pass
+  return offsets
+
+# ======================================================================================================================
+
+def parse_atom(line):
+  '''Returns symbol, atomic number, coordinates, mass (in g/mol) and velocities
+of an atom line of an initconds file, as the text readers obtain them.'''
+  s=line.split()
+  return s[0],float(s[1]),[ float(x) for x in s[2:5] ],float(s[5]),[ float(x) for x in s[6:9] ]
+
+# ======================================================================================================================
+
+def parse_state(line):
+  '''Returns number, energy, reference energy, transition dipole and excitation
+flag of a state line of an initconds file, as the text readers obtain them.'''
+  s=line.split()
+  dip=[ complex(float(s[i]),float(s[i+1])) for i in [3,5,7] ]
+  return int(s[0]),float(s[1]),float(s[2]),dip,len(s)>11 and s[11]=='True'
+
+# ======================================================================================================================
+
+def parse_block(block):
+  '''Returns the atoms, states and the harmonic potential energy of the text
+block of one initial condition (starting with the line "Atoms").'''
+  lines=block.split('\n')
+  i=1
+  atoms=[]
+  while not 'States' in lines[i]:
+    atoms.append(parse_atom(lines[i]))
+    i+=1
+  i+=1
+  states=[]
+  while not 'Ekin' in lines[i]:
+    states.append(parse_state(lines[i]))
+    i+=1
+  epot_harm=0.
+  for line in lines[i:]:
+    if 'epot_harm' in line.lower():
+      epot_harm=float(line.split()[1])
+      break
+  return atoms,states,epot_harm
+
+# ======================================================================================================================
+
+class SIDECAR:
+  '''Writes the binary sidecar <filename>.sidecar of an initconds file while
+the text file is written. All arrays are preallocated as .npy files on disk
+(index 0 is the equilibrium geometry) and filled condition by condition from
+the text blocks, so that they contain exactly the values a reader of the
+text gets and the memory does not grow with the number of conditions.
+The sidecar is assembled in <filename>.sidecar.tmp and only moved to its
+place by close(), after the text file has been closed.'''
+
+  def __init__(self,filename,ninit,equilibrium,nstate=0):
+    self.filename=filename
+    self.ninit=ninit
+    self.natom=len(equilibrium)
+    self.nstate=nstate
+    self.complete=True
+    self.tmpdir=filename+'.sidecar.tmp'
+    if os.path.isdir(self.tmpdir):
+      shutil.rmtree(self.tmpdir)
+    os.mkdir(self.tmpdir)
+    atoms=[ parse_atom(line) for line in equilibrium ]
+    numpy.save(self.tmpdir+'/symb.npy',numpy.array([ atom[0] for atom in atoms ]))
+    numpy.save(self.tmpdir+'/num.npy',numpy.array([ atom[1] for atom in atoms ]))
+    numpy.save(self.tmpdir+'/mass.npy',numpy.array([ atom[3] for atom in atoms ]))
+    self.arrays={}
+    for key, dtype, shape in ATOMFIELDS:
+      self.arrays[key]=self.open(key,dtype,(ninit+1,self.natom)+shape)
+    self.arrays['epot_harm']=self.open('epot_harm',float,(ninit+1,))
+    self.arrays['nstate']=self.open('nstate',int,(ninit+1,))
+    for key, dtype, shape in STATEFIELDS:
+      self.arrays[key]=self.open(key,dtype,(ninit+1,nstate)+shape)
+    self.arrays['coord'][0]=[ atom[2] for atom in atoms ]
+    self.arrays['veloc'][0]=[ atom[4] for atom in atoms ]
+
+  def open(self,key,dtype,shape):
+    return numpy.lib.format.open_memmap(self.tmpdir+'/%s.npy' % (key),mode='w+',dtype=dtype,shape=shape)
+
+  def add(self,index,block):
+    '''Stores initial condition index from its text block (starting with "Atoms").'''
+    try:
+      atoms,states,epot_harm=parse_block(block)
+    except (ValueError, IndexError):
+      self.complete=False
+      return
+    if len(atoms)!=self.natom or len(states)>self.nstate:
+      self.complete=False
+      return
+    self.arrays['coord'][index]=[ atom[2] for atom in atoms ]
+    self.arrays['veloc'][index]=[ atom[4] for atom in atoms ]
+    self.arrays['epot_harm'][index]=epot_harm
+    self.arrays['nstate'][index]=len(states)
+    for j, state in enumerate(states):
+      for k, (key, dtype, shape) in enumerate(STATEFIELDS):
+        self.arrays[key][index,j]=state[k]
+
+  def close(self):
+    '''Flushes the arrays and moves the sidecar to <filename>.sidecar,
+stamped with the size and modification time of the text file. An
+incomplete sidecar is removed instead.'''
+    for key in self.arrays:
+      self.arrays[key].flush()
+    self.arrays={}
+    final=self.filename+'.sidecar'
+    try:
+      if not self.complete:
+        print 'Initial conditions do not fit into the sidecar, %s is not written.' % (final)
+        shutil.rmtree(self.tmpdir)
+        return
+      filestat=os.stat(self.filename)
+      f=open(self.tmpdir+'/stamp','w')
+      f.write('%i %i %i %r\n' % (self.ninit,self.natom,filestat.st_size,filestat.st_mtime))
+      f.close()
+      if os.path.isdir(final):
+        shutil.rmtree(final)
+      os.rename(self.tmpdir,final)
+    except (IOError, OSError):
+      print 'Could not write %s!' % (final)
+
+# ======================================================================================================================
+
+def open_sidecar(filename,ninit,equilibrium,nstate=0):
+  '''Returns a SIDECAR for the initconds file filename, which is about to be
+written, or None without numpy or if the sidecar cannot be created.
+equilibrium are the atom lines of the equilibrium geometry and nstate the
+largest number of states of a condition.'''
+  if NONUMPY:
+    return None
+  try:
+    return SIDECAR(filename,ninit,equilibrium,nstate)
+  except (IOError, OSError, ValueError, IndexError):
+    print 'Could not write %s.sidecar!' % (filename)
+  return None
+
+# ======================================================================================================================
+
+def read_initconds_sidecar(filename,ninit,natom):
+  '''Returns the arrays of the binary sidecar <filename>.sidecar of an initconds
+file, mapped from disk, or None if there is none or if it does not belong to the
+current text file.'''
+  sidecar=filename+'.sidecar'
+  if NONUMPY or not os.path.isfile(sidecar+'/stamp'):
+    return None
+  try:
+    f=open(sidecar+'/stamp')
+    stamp=f.readline()
+    f.close()
+    filestat=os.stat(filename)
+    if stamp!='%i %i %i %r\n' % (ninit,natom,filestat.st_size,filestat.st_mtime):
+      return None
+    data={}
+    for key in ['symb','num','mass','epot_harm','nstate']+[ field[0] for field in ATOMFIELDS+STATEFIELDS ]:
+      data[key]=numpy.load(sidecar+'/%s.npy' % (key),mmap_mode='r')
+    return data
+  except (IOError, OSError, ValueError):
+    pass
+  return None
+
+# ======================================================================================================================
+
+def sidecar_condition(data,index):
+  '''Returns the atoms (symbol, atomic number, coordinates, mass in g/mol,
+velocities), the states (number, energy, reference energy, transition dipole,
+excitation flag) and the harmonic potential energy of initial condition index
+of a sidecar.'''
+  atoms=[]
+  for iatom in range(len(data['symb'])):
+    atoms.append((str(data['symb'][iatom]),float(data['num'][iatom]),data['coord'][index,iatom].tolist(),float(data['mass'][iatom]),data['veloc'][index,iatom].tolist()))
+  states=[]
+  for istate in range(data['nstate'][index]):
+    states.append((int(data['state_i'][index,istate]),float(data['state_e'][index,istate]),float(data['state_eref'][index,istate]),data['state_dip'][index,istate].tolist(),bool(data['state_excited'][index,istate])))
+  return atoms,states,float(data['epot_harm'][index])
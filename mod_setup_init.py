@@ -46,6 +46,14 @@ import time
 import ast
 import pprint
 
+import mod_initconds
+
+try:
+  import numpy
+  NONUMPY=False
+except ImportError:
+  NONUMPY=True
+
 # =========================================================
 # compatibility stuff
 
@@ -1442,15 +1450,7 @@ def get_LVC(INFOS):
 
   if GYM:
     INFOS['LVC.template']='LVC.template'
-    template = open('LVC.template', 'r')
-    template.readline()
-    states = [ int(x) for x in template.readline().split() ]
-    print states
-    nstates=0
-    for mult,i in enumerate(states):
-      nstates+=(mult+1)*i
-    INFOS['states']=states
-    INFOS['nstates']=nstates
+    INFOS=get_LVC_states(INFOS)
       
 
   else:
@@ -1474,6 +1474,22 @@ def get_LVC(INFOS):
 
 # =================================================
 
+def get_LVC_states(INFOS):
+  #the number of states is read from the template in the SHARC gym
+  template = open(INFOS['LVC.template'], 'r')
+  template.readline()
+  states = [ int(x) for x in template.readline().split() ]
+  template.close()
+  print states
+  nstates=0
+  for mult,i in enumerate(states):
+    nstates+=(mult+1)*i
+  INFOS['states']=states
+  INFOS['nstates']=nstates
+  return INFOS
+
+# =================================================
+
 def prepare_LVC(INFOS,iconddir):
   # copy LVC.template
 
@@ -3249,15 +3265,13 @@ def make_directory(iconddir):
 
 # ======================================================================================================================
 
-def writeQMin(INFOS,iconddir):
-  icond=int(iconddir[-6:-1])
-  try:
-    qmin=open('%s/QM.in' % (iconddir), 'w')
-  except IOError:
-    print 'IOError during writeQMin, icond=%s' % (iconddir)
-    quit(1)
-  string='%i\nInitial condition %s\n' % (INFOS['natom'],iconddir)
-
+def read_QMin_geometry(INFOS,icond):
+  '''Returns the geometry lines of initial condition icond (0 is the equilibrium)
+for QM.in, as found in the text of the initconds file.'''
+  string=''
+  offsets=INFOS.get('initoffsets')
+  if offsets and icond in offsets:
+    INFOS['initf'].seek(offsets[icond])
   if icond>0:
     searchstring='Index\s+%i' % (icond)
   else:
@@ -3282,6 +3296,20 @@ def writeQMin(INFOS,iconddir):
     line=INFOS['initf'].readline()
     s=line.split()
     string+='%s %s %s %s\n' % (s[0],s[2],s[3],s[4])
+  return string
+
+# ======================================================================================================================
+
+def writeQMin(INFOS,iconddir):
+  icond=int(iconddir[-6:-1])
+  try:
+    qmin=open('%s/QM.in' % (iconddir), 'w')
+  except IOError:
+    print 'IOError during writeQMin, icond=%s' % (iconddir)
+    quit(1)
+  string='%i\nInitial condition %s\n' % (INFOS['natom'],iconddir)
+
+  string+=read_QMin_geometry(INFOS,icond)
 
   string+='unit bohr\nstates '
   for i in INFOS['states']:
@@ -3440,6 +3468,7 @@ def setup_all(INFOS):
   ninit=INFOS['irange'][1]-INFOS['irange'][0]+1
   idone=0
 
+  INFOS['initoffsets']=mod_initconds.index_initconds(INFOS['initf'].name)
   EqExists=setup_equilibrium(INFOS)
   if not EqExists:
     iconddir='ICOND_%05i/' % (0)
@@ -3487,6 +3516,61 @@ def setup_all(INFOS):
 # ======================================================================================================================
 # ======================================================================================================================
 
+def ask(gym=False):
+  '''Asks all questions of the interactive setup in the current directory and
+returns the INFOS dictionary. INFOS['setup'] contains whether the calculations 
+should be set up. The keystrokes file is kept open until close_keystrokes().'''
+
+  global GYM
+  GYM=gym
+  displaywelcome()
+  open_keystrokes()
+
+  INFOS=get_general()
+  INFOS=globals()[Interfaces[ INFOS['interface']]['get_routine'] ](INFOS)
+  INFOS=get_runscript_info(INFOS)
+
+  print '\n'+centerstring('Full input',60,'#')+'\n'
+  for item in INFOS:
+    print item, ' '*(25-len(item)), INFOS[item]
+  print ''
+  INFOS['setup']=question('Do you want to setup the specified calculations?',bool,True)
+  print ''
+
+  return INFOS
+
+# ======================================================================================================================
+
+def setup(INFOS, path):
+  '''Sets up the initial condition calculations in the directory path with the
+answers given in ask(), without asking again. The initconds file and, in the 
+SHARC gym, the number of states of the LVC.template are taken from path.'''
+
+  global GYM
+  GYM=True
+  INFOS=dict(INFOS)
+  cwd=os.getcwd()
+  os.chdir(path)
+  initf=open('initconds')
+  initf.readline()
+  INFOS['ninit']=int(initf.readline().split()[1])
+  INFOS['natom']=int(initf.readline().split()[1])
+  initf.seek(0)
+  INFOS['initf']=initf
+  INFOS['irange']=[1,INFOS['ninit']]
+  INFOS['cwd']=os.getcwd()
+  if 'LVC.template' in INFOS:
+    INFOS=get_LVC_states(INFOS)
+
+  setup_all(INFOS)
+
+  initf.close()
+  del INFOS['initf']
+  os.chdir(cwd)
+  return INFOS
+
+# ======================================================================================================================
+
 def main():
   '''Main routine'''
 
@@ -3505,25 +3589,8 @@ Afterwards, it asks for the interface used and goes through the preparation depe
 
   (options, args) = parser.parse_args()
 
-  global GYM
-  GYM=options.GYM
-
-
-  displaywelcome()
-  open_keystrokes()
-
-  INFOS=get_general()
-  INFOS=globals()[Interfaces[ INFOS['interface']]['get_routine'] ](INFOS)
-  INFOS=get_runscript_info(INFOS)
-
-  print '\n'+centerstring('Full input',60,'#')+'\n'
-  for item in INFOS:
-    print item, ' '*(25-len(item)), INFOS[item]
-  print ''
-  setup=question('Do you want to setup the specified calculations?',bool,True)
-  print ''
-
-  if setup:
+  INFOS=ask(options.GYM)
+  if INFOS['setup']:
     setup_all(INFOS)
 
   close_keystrokes()
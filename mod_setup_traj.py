@@ -46,6 +46,14 @@ import time
 from socket import gethostname
 import ast
 
+import mod_initconds
+
+try:
+  import numpy
+  NONUMPY=False
+except ImportError:
+  NONUMPY=True
+
 # =========================================================0
 # compatibility stuff
 
@@ -407,7 +415,9 @@ class INITCOND:
     self.nstate=len(statelist)
     self.Epot=self.statelist[0].e-self.eref
 
-  def init_from_file(self,f,eref,index):
+  def init_from_file(self,f,eref,index,offsets=None):
+    if offsets and index in offsets:
+      f.seek(offsets[index])
     while True:
       line=f.readline()
       #if 'Index     %i' % (index) in line:
@@ -453,6 +463,26 @@ class INITCOND:
     else:
       self.Epot=epot_harm
 
+  def init_from_sidecar(self,data,eref,index):
+    atoms,states,epot_harm=mod_initconds.sidecar_condition(data,index)
+    atomlist=[ ATOM(symb,num,coord,mass*U_TO_AMU,veloc) for symb,num,coord,mass,veloc in atoms ]
+    statelist=[]
+    for i,e,eref_state,dip,excited in states:
+      state=STATE(i,e,eref_state,dip)
+      state.Excited=excited
+      statelist.append(state)
+    self.atomlist=atomlist
+    self.eref=eref
+    self.Epot_harm=epot_harm
+    self.natom=len(atomlist)
+    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
+    self.statelist=statelist
+    self.nstate=len(statelist)
+    if self.nstate>0:
+      self.Epot=self.statelist[0].e-self.eref
+    else:
+      self.Epot=self.Epot_harm
+
   def __str__(self):
     s='Atoms\n'
     for atom in self.atomlist:
@@ -736,9 +766,15 @@ def get_initconds(INFOS):
 
   INFOS['initf'].seek(0)                 # rewind the initf file
   initlist=[]
+  data=mod_initconds.read_initconds_sidecar(INFOS['initf'].name,INFOS['ninit'],INFOS['natom'])
+  if not data:
+    offsets=mod_initconds.index_initconds(INFOS['initf'].name)
   for icond in range(1,INFOS['ninit']+1):
     initcond=INITCOND()
-    initcond.init_from_file(INFOS['initf'],INFOS['eref'],icond)
+    if data:
+      initcond.init_from_sidecar(data,INFOS['eref'],icond)
+    else:
+      initcond.init_from_file(INFOS['initf'],INFOS['eref'],icond,offsets)
     initlist.append(initcond)
   print 'Number of initial conditions in file:       %5i' % (INFOS['ninit'])
 
@@ -32,6 +32,7 @@
 # usage python wigner.py [-n <NUMBER>] <MOLDEN-FILE>
 
 import copy
+import os
 import math
 import cmath
 import random
@@ -40,6 +41,10 @@ import datetime
 from optparse import OptionParser
 import re
 import time
+import bisect
+import hashlib
+
+import mod_initconds
 
 # =========================================================0
 # compatibility stuff
@@ -78,6 +83,15 @@ U_TO_AMU = 1./5.4857990943e-4            # conversion from g/mol to amu
 ANG_TO_BOHR = 1./0.529177211    #1.889725989      # conversion from Angstrom to bohr
 PI = math.pi
 
+# cumulative vibrational state populations per (frequency, temperature)
+STATE_TABLES = {}
+# coefficients of the Laguerre recurrence, see laguerre_coefficients
+LAGUERRE_COEFFS = []
+# directory for the parsed MOLDEN files and their normal mode formats, the 
+# files are named by the sha1 of the MOLDEN file. Nothing is cached if None,
+# the SHARC gym sets it to its gym_cache directory
+CACHE_DIR = None
+
 version='2.1'
 versiondate=datetime.date(2019,9,1)
 
@@ -589,81 +603,129 @@ def get_mass(symb,number):
 
 # ======================================================================================================================
 
+def read_molden(filename):
+  '''This function reads a MOLDEN file in a single pass. Returns a dictionary
+with the atomic symbols and coordinates, the number of modes in [N_FREQ] (-1 if 
+not given), the frequencies (in cm^-1) and displacement vectors of the modes, the
+lines of the file, the numbers of the lines of the [FREQ] section and the sha1 
+of the file. With numpy and if CACHE_DIR is set, the parsed data is cached there
+under the sha1 of the file, so that the directory of the MOLDEN file is never 
+written to.'''
+  try:
+    f=open(filename)
+    data=f.readlines()
+    f.close()
+  except IOError:
+    print 'Could not read %s!' % (filename)
+    quit(1)
+  key=hashlib.sha1(''.join(data)).hexdigest()
+  cachefile=None
+  if np and CACHE_DIR:
+    cachefile=os.path.join(CACHE_DIR, key+'.molden.npz')
+  if cachefile and os.path.isfile(cachefile):
+    try:
+      cache=numpy.load(cachefile)
+      molden={'key':key, 'lines':data}
+      if str(cache['key'])==key:
+        for entry in ['symbols','coords','nfreq','freq','move','freq_lines']:
+          molden[entry]=cache[entry].tolist()
+      cache.close()
+      if 'move' in molden:
+        return molden
+    except (IOError, KeyError, ValueError):
+      pass
+
+  molden={'key':key, 'lines':data, 'symbols':[], 'coords':[], 'nfreq':-1, 'freq':[], 'move':[], 'freq_lines':[]}
+  section=''
+  freq_done=False
+  for iline, line in enumerate(data):
+    if '[' in line:
+      section=line
+      continue
+    f=line.split()
+    if 'FR-COORD' in section:
+      molden['symbols'].append(f[0])
+      molden['coords'].append([ float(f[i+1]) for i in range(3) ])
+    elif 'N_FREQ' in section:
+      if molden['nfreq']==-1 and len(f)>0:
+        molden['nfreq']=int(line)
+    elif '[FREQ]' in section:
+      molden['freq_lines'].append(iline)
+      # the frequencies end with the first line that is not a number
+      if not freq_done:
+        try:
+          molden['freq'].append(float(line))
+        except ValueError:
+          freq_done=True
+    elif 'FR-NORM-COORD' in section:
+      if len(f)==0:
+        continue
+      if 'vibration' in line.lower():
+        molden['move'].append([])
+      elif len(molden['move'])>0:
+        # the displacements end with the first line that is not a vector
+        try:
+          molden['move'][-1].append([ float(f[i]) for i in range(3) ])
+        except (ValueError, IndexError):
+          section=''
+
+  if cachefile:
+    # the cache is written under a temporary name first, a cache that cannot 
+    # be written is skipped
+    tmpfile='%s.%i.tmp.npz' % (cachefile[:-4], os.getpid())
+    try:
+      if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+      numpy.savez(tmpfile, key=key, symbols=numpy.array(molden['symbols']), coords=numpy.array(molden['coords']).reshape(-1,3),
+                  nfreq=molden['nfreq'], freq=numpy.array(molden['freq']), move=numpy.array(molden['move']), freq_lines=numpy.array(molden['freq_lines'], dtype=int))
+      os.rename(tmpfile, cachefile)
+    except (IOError, OSError, ValueError):
+      pass
+  return molden
+
 def import_from_molden(filename,scaling,flag,lvc=False):
   '''This function imports atomic coordinates and normal modes from a MOLDEN
 file. Returns molecule and modes as the other function does.
 '''
-  f=open(filename)
-  data=f.readlines()
-  f.close()
+  molden=read_molden(filename)
 
-  # find coordinate block
-  iline=0
-  while not 'FR-COORD' in data[iline]:
-    iline+=1
-    if iline==len(data):
-      print 'Could not find coordinates in %s!' % (filename)
-      quit(1)
   # get atoms
-  iline+=1
+  if len(molden['symbols'])==0:
+    print 'Could not find coordinates in %s!' % (filename)
+    quit(1)
   natom=0
   molecule=[]
-  while not '[' in data[iline]:
-    f=data[iline].split()
-    symb=f[0].lower().title()
+  for symb, coord in zip(molden['symbols'], molden['coords']):
+    symb=symb.lower().title()
     num=NUMBERS[symb]
-    coord=[ float(f[i+1]) for i in range(3) ]
     natom+=1
     mass=get_mass(symb,natom)
     whichatoms.append(symb)
     molecule.append(ATOM(symb,num,coord,mass))
-    iline+=1
 
   # find number of frequencies
-  iline=-1
-  nmodes=-1
-  while True:
-    iline+=1
-    if iline==len(data):
-      nmodes=3*natom
-      break
-    line=data[iline]
-    if 'N_FREQ' in line:
-      nmodes=int(data[iline+1])
-      break
+  nmodes=molden['nfreq']
+  if nmodes==-1:
+    nmodes=3*natom
 
   # warn, if too few normal modes were found
   if nmodes<3*natom:
     print '*'*51+'\nWARNING: Less than 3*N_atom normal modes extracted!\n'+'*'*51+'\n'
 
   # obtain all frequencies, including low ones
-  iline=0
   modes=[]
-  while not '[FREQ]' in data[iline]:
-    iline+=1
-  iline+=1
   for imode in range(nmodes):
-    try:
-      mode={'freq':float(data[iline+imode])*CM_TO_HARTREE * scaling}
+    if imode<len(molden['freq']):
+      mode={'freq':molden['freq'][imode]*CM_TO_HARTREE * scaling, 'nr':imode+1}
       modes.append(mode)
-    except ValueError:
+    else:
       print '*'*51+'\nWARNING: Less than 3*N_atom normal modes, but no [N_FREQ] keyword!\n'+'*'*51+'\n'
       nmodes=imode
       break
 
   # obtain normal coordinates
-  iline=0
-  while not 'FR-NORM-COORD' in data[iline]:
-    iline+=1
-  iline+=1
   for imode in range(nmodes):
-    iline+=1
-    move=[]
-    for iatom in range(natom):
-      f=data[iline].split()
-      move.append([ float(f[i]) for i in range(3) ])
-      iline+=1
-    modes[imode]['move']=move
+    modes[imode]['move']=[ list(move) for move in molden['move'][imode][:natom] ]
     # normalization stuff
     norm = 0.0
     for j, atom in enumerate(molecule):
@@ -693,10 +755,48 @@ file. Returns molecule and modes as the other function does.
   modes=newmodes  
 
   nmodes = len(modes)
-  modes = determine_normal_modes_format(modes,molecule,nmodes,flag)
+  # the detected format is kept in the cache directory
+  key = hashlib.sha1(molden['key']+repr((LOW_FREQ,lvc))).hexdigest()
+  cachefile = None
+  if CACHE_DIR:
+    cachefile = os.path.join(CACHE_DIR, key+'.nm_format')
+  if flag == 0 and cachefile:
+    cached = read_normal_modes_format(cachefile, key)
+    if cached:
+      print '\nNormal mode format %i was already determined for %s.' % (cached, filename)
+      modes, cached = determine_normal_modes_format(modes,molecule,nmodes,cached)
+      return molecule, modes
+  modes, nm_flag = determine_normal_modes_format(modes,molecule,nmodes,flag)
+  if flag == 0 and cachefile:
+    write_normal_modes_format(cachefile, key, nm_flag)
 
   return molecule, modes
 
+def read_normal_modes_format(cachefile, key):
+  '''Returns the normal mode format specifier stored in cachefile, if it was
+determined for the MOLDEN file with the given key, otherwise 0.'''
+  try:
+    f=open(cachefile)
+    line=f.read().split()
+    f.close()
+  except IOError:
+    return 0
+  if len(line)==2 and line[0]==key and line[1] in ['1','2','3','4']:
+    return int(line[1])
+  return 0
+
+def write_normal_modes_format(cachefile, key, flag):
+  '''Stores the normal mode format specifier of the MOLDEN file with the 
+given key in cachefile. A cache that cannot be written is silently skipped.'''
+  try:
+    if not os.path.isdir(os.path.dirname(cachefile)):
+      os.makedirs(os.path.dirname(cachefile))
+    f=open(cachefile,'w')
+    f.write('%s %i\n' % (key, flag))
+    f.close()
+  except (IOError, OSError):
+    pass
+
 # ======================================================================================================================
 # ======================================================================================================================
 # ======================================================================================================================
@@ -721,30 +821,32 @@ file. Returns molecule and modes as the other function does.
       #total += entry
     #return total
 
-def facfac_loop(n):
-  yield 0, 1.
-  r=1.
-  for m in range(1,n+1):
-    r*=float(n-m+1)/m**2
-    yield m,r
-  return
+def laguerre_coefficients(n):
+  """This function returns the coefficients (a_k, b_k, c_k) of the three-term 
+recurrence L_k+1(x) = (a_k - b_k*x) L_k(x) - c_k L_k-1(x) for k < n. They are 
+only computed once and extended as higher orders are requested."""
+  for k in range(len(LAGUERRE_COEFFS), n):
+    LAGUERRE_COEFFS.append( ( (2.*k+1.)/(k+1.), 1./(k+1.), float(k)/(k+1.) ) )
+  return LAGUERRE_COEFFS[:n]
 
 def ana_laguerre(n, x):
-    """This function analytically calculates the value of the nth order
-Laguerre polynomial at point x. Computational limitations restrict very high 
-excited vibrational states (above 170). However, the harmonic approximation 
-is no good approximation at these high-lying vibrational states!"""
-    total = 0.
-    for m,r in facfac_loop(n):
-      entry = (-1.)**m * r * x**m
-      total += entry
+    """This function calculates the value of the nth order Laguerre polynomial 
+at point x (a number or a numpy array) with the three-term recurrence, which 
+stays stable also for the high-lying vibrational states."""
+    previous = 0.
+    total = 1. + 0.*x
+    for a, b, c in laguerre_coefficients(n):
+      previous, total = total, (a - b*x) * total - c * previous
     return total
 
 
-
-def determine_state(mode):
-  """This function determines the vibrational state of the
-mode for the system at a certain temperature."""
+def state_table(mode):
+  """This function returns the cumulative probabilities of the vibrational
+states of the mode at the current temperature. The tables are only built once
+for each frequency and temperature."""
+  key = (mode['freq'], temperature)
+  if key in STATE_TABLES:
+    return STATE_TABLES[key]
   # every state has a finite probability of being populated
   # at a finite temperature. we restrict only to so many
   # states that the sum of populations is "thresh"
@@ -761,38 +863,43 @@ mode for the system at a certain temperature."""
                        ( 1. - math.exp(-exponent) )
   n=-1
   sum_p=0.
-  prob=[]
+  cumulative=[]
   # calculate probabilities until sum is larger than threshold
   while True:
     n += 1
     p = math.exp(-exponent*(n+1./2.))/partition_function
-    prob.append(p)
-    sum_p += prob[n]
+    sum_p += p
+    cumulative.append(sum_p)
     if sum_p >= thresh:
       break
-  n=-1
-  probability = 0.
+  STATE_TABLES[key] = cumulative
+  return cumulative
+
+def determine_state(mode):
+  """This function determines the vibrational state of the
+mode for the system at a certain temperature."""
+  cumulative = state_table(mode)
+  sum_p = cumulative[-1]
   # generate random number that is smaller than threshold
   while True:
     random_state = random.random()
     if random_state < sum_p:
       break
   # determine state number by comparing with random number
-  while True:
-    n += 1
-    probability += prob[n]
-    if probability >= random_state:
-      return n
-      break
-
-
-def wigner(Q, P, mode):
-    """This function calculates the Wigner distribution for
-a single one-dimensional harmonic oscillator.
-Q contains the dimensionless coordinate of the
-oscillator and P contains the corresponding momentum.
-n is the number of the vibrational state (default 0).
-The function returns a probability for this set of parameters."""
+  return bisect.bisect_left(cumulative, random_state)
+
+def determine_states(mode, amount):
+  """This function determines the vibrational states of the mode for amount
+samples at once, by looking up uniform random numbers below the threshold in
+the table of cumulative probabilities."""
+  cumulative = numpy.array(state_table(mode))
+  random_state = numpy.random.random(amount) * cumulative[-1]
+  return numpy.searchsorted(cumulative, random_state, side='left')
+
+def vibrational_state(mode):
+    """This function returns the vibrational state of the mode that is used 
+in the Wigner distribution, 0 at zero temperature. -1 means that the state is 
+discarded."""
     if temperature == 0:
       n = 0
     else:
@@ -805,8 +912,33 @@ The function returns a probability for this set of parameters."""
           n = -1
           print 'Highest considered vibrational state reached! Discarding this probability.'
         else:
-          print 'The calculated excited vibrational state for this normal mode exceeds the limit of the calculation.\nThe harmonic approximation is not valid for high vibrational states of low-frequency normal modes. The vibrational state ',n,' was set to 150. If you want to discard these states instead (due to oversampling of state nr 150), use the -T option.'
+          print 'The calculated excited vibrational state for this normal mode exceeds the limit of the calculation.\nThe harmonic approximation is not valid for high vibrational states of low-frequency normal modes. The vibrational state ',n,' was set to 500. If you want to discard these states instead (due to oversampling of state nr 500), use the -T option.'
           n = 500
+    return n
+
+def vibrational_states(mode, amount):
+    """This function returns the vibrational states of the mode for amount
+samples at once, with the same treatment of high states as vibrational_state."""
+    if temperature == 0:
+      return numpy.zeros(amount, dtype=int)
+    n = determine_states(mode, amount)
+    if (n > 500).any():
+      if high_temp:
+        print 'Highest considered vibrational state reached! Discarding this probability.'
+        n[n > 500] = -1
+      else:
+        print 'The calculated excited vibrational state for this normal mode exceeds the limit of the calculation.\nThe harmonic approximation is not valid for high vibrational states of low-frequency normal modes. The vibrational state ',n.max(),' was set to 500. If you want to discard these states instead (due to oversampling of state nr 500), use the -T option.'
+        n[n > 500] = 500
+    return n
+
+def wigner(Q, P, mode):
+    """This function calculates the Wigner distribution for
+a single one-dimensional harmonic oscillator.
+Q contains the dimensionless coordinate of the
+oscillator and P contains the corresponding momentum.
+n is the number of the vibrational state (default 0).
+The function returns a probability for this set of parameters."""
+    n = vibrational_state(mode)
     if n == 0: # vibrational ground state
         return (math.exp(-Q**2) * math.exp(-P**2), 0.)
     # TODO: what about n==-1 ??
@@ -886,37 +1018,33 @@ geometry of an initial condition."""
         for xyz in range(3):
             atom.coord[xyz] += diff[xyz]
 
-def remove_translations(ic):
-    """This function calculates the movement of the center of mass
-of an initial condition for a small timestep and removes this vector
-from the initial condition's velocities."""
-    # get center of mass at t = 0.0
-    com = get_center_of_mass(ic)
-    # get center of mass at t = dt = 0.01
-    ic2 = copy.deepcopy(ic)
-    dt = 0.01
-    for atom in ic2:
-        for xyz in range(3):
-            atom.coord[xyz] += dt*atom.veloc[xyz]
-    com2 = get_center_of_mass(ic2)
-    # calculate velocity of center of mass and remove it
-    v_com = [ (com2[xyz]-com[xyz])/dt for xyz in range(3) ]
+def remove_translations(ic, legacy=False):
+    """This function calculates the velocity of the center of mass
+of an initial condition and removes this vector from the initial 
+condition's velocities. With legacy, the velocity is obtained as in 
+previous versions from the movement of the center of mass during a 
+small timestep, which reproduces their initial conditions."""
+    mass = 0.0
+    for atom in ic:
+        mass += atom.mass
+    v_com = [0.0 for xyz in range(3)]
+    if legacy:
+        # get center of mass at t = 0.0 and at t = dt = 0.01
+        com = get_center_of_mass(ic)
+        dt = 0.01
+        ic2 = [ ATOM(atom.symb, atom.num, [ atom.coord[xyz] + dt*atom.veloc[xyz] for xyz in range(3) ], atom.mass, atom.veloc) for atom in ic ]
+        com2 = get_center_of_mass(ic2)
+        v_com = [ (com2[xyz]-com[xyz])/dt for xyz in range(3) ]
+    else:
+        for atom in ic:
+            for xyz in range(3):
+                v_com[xyz] += atom.veloc[xyz] * atom.mass / mass
     for atom in ic:
         for xyz in range(3):
             atom.veloc[xyz] -= v_com[xyz]
     if DEBUG:
         # check if v_com now is really zero
-        # get center of mass at t = 0.0
-        com = get_center_of_mass(ic)
-        # get center of mass at t = dt = 1.0
-        ic2 = copy.deepcopy(ic)
-        dt = 1.0
-        for atom in ic2:
-            for xyz in range(3):
-                atom.coord[xyz] += dt*atom.veloc[xyz]
-        com2 = get_center_of_mass(ic2)
-        # calculate velocity of center of mass and remove it
-        v_com = [ (com2[xyz]-com[xyz])/dt for xyz in range(3) ]
+        v_com = [ sum( [atom.veloc[xyz] * atom.mass / mass for atom in ic] ) for xyz in range(3) ]
         print v_com
 
 
@@ -926,8 +1054,9 @@ def det(m):
          + m[0][2]*m[1][0]*m[2][1] - m[0][0]*m[1][2]*m[2][1] \
          - m[0][1]*m[1][0]*m[2][2] - m[0][2]*m[1][1]*m[2][0]
 
-def inverted(m):
-    """This function calculates the inverse of a 3x3 matrix."""
+def inverted(m, legacy=False):
+    """This function calculates the inverse of a 3x3 matrix. With legacy,
+the element [2][1] is left at zero as in previous versions."""
     norm = m[0][0] * (m[1][1]*m[2][2] - m[1][2]*m[2][1]) \
          + m[0][1] * (m[1][2]*m[2][0] - m[1][0]*m[2][2]) \
          + m[0][2] * (m[1][0]*m[2][1] - m[1][1]*m[2][0])
@@ -939,7 +1068,8 @@ def inverted(m):
     m_inv[1][1] = (m[0][0]*m[2][2] - m[0][2]*m[2][0]) / norm
     m_inv[1][2] = (m[0][2]*m[1][0] - m[0][0]*m[1][2]) / norm
     m_inv[2][0] = (m[1][0]*m[2][1] - m[1][1]*m[2][0]) / norm
-    m_inv[2][2] = (m[0][1]*m[2][0] - m[0][0]*m[2][1]) / norm
+    if not legacy:
+        m_inv[2][1] = (m[0][1]*m[2][0] - m[0][0]*m[2][1]) / norm
     m_inv[2][2] = (m[0][0]*m[1][1] - m[0][1]*m[1][0]) / norm
     return m_inv
 
@@ -971,14 +1101,13 @@ def linmapping(lm, y):
     z[2] = lm[2][0]*y[0] + lm[2][1]*y[1] + lm[2][2]*y[2]
     return z
 
-def remove_rotations(ic):
-    # copy initial condition object
-    ictmp = copy.deepcopy(ic)
+def remove_rotations(ic, legacy=False):
+    """This function removes the angular momentum of an initial condition 
+from the velocities of its atoms. With legacy, the inverse of the moment of 
+inertia tensor is formed as in previous versions (see inverted)."""
     # move center of mass to coordinates (0, 0, 0)
     com = get_center_of_mass(ic)
-    for atom in ictmp:
-        for xyz in range(3):
-            atom.coord[xyz] -= com[xyz]
+    ictmp = [ ATOM(atom.symb, atom.num, [ atom.coord[xyz] - com[xyz] for xyz in range(3) ], atom.mass, atom.veloc) for atom in ic ]
     # calculate moment of inertia tensor
     I = [[0.0 for i in range(3)] for j in range(3)]
     for atom in ictmp:
@@ -992,7 +1121,6 @@ def remove_rotations(ic):
     I[2][0] = I[0][2]
     I[2][1] = I[1][2]
     if det(I) > 0.01: # checks if I is invertible
-        ch = matmul(I, inverted(I))
         # calculate angular momentum
         ang_mom = [0.0 for i in range(3)]
         for atom in ictmp:
@@ -1003,7 +1131,7 @@ def remove_rotations(ic):
             for xyz in range(3):
                 ang_mom[xyz] -= L[xyz]
         # calculate angular velocity
-        ang_vel = linmapping(inverted(I), ang_mom)
+        ang_vel = linmapping(inverted(I, legacy), ang_mom)
         for i,atom in enumerate(ictmp):
             v_rot = cross_prod(ang_vel, atom.coord) # calculate rotational velocity
             for xyz in range(3):
@@ -1011,6 +1139,34 @@ def remove_rotations(ic):
     else:
         print 'WARNING: moment of inertia tensor is not invertible'
 
+def remove_rigid_body_motion(coord, veloc, mass, com):
+    """This function projects the rigid-body motion out of a whole batch of 
+initial conditions at once. coord and veloc are (amount, natom, 3) arrays, mass 
+contains the natom atomic masses and com the center of mass to be restored. 
+For each initial condition, the geometry is shifted to com and the velocity of 
+the center of mass and the angular momentum (obtained from the moment of 
+inertia tensor by an exact linear solve) are removed from the velocities, as 
+restore_center_of_mass, remove_translations and remove_rotations do for a 
+single initial condition. Returns the new coordinates and velocities."""
+    weights = mass / numpy.sum(mass)
+    # move center of mass to com and remove its velocity
+    coord = coord - numpy.einsum('a,iax->ix', weights, coord)[:,None,:] + numpy.asarray(com)
+    veloc = veloc - numpy.einsum('a,iax->ix', weights, veloc)[:,None,:]
+    # moment of inertia tensor of the coordinates relative to com
+    r = coord - numpy.asarray(com)
+    r2 = numpy.einsum('a,iax,iax->i', mass, r, r)
+    I = r2[:,None,None] * numpy.eye(3) - numpy.einsum('a,iax,iay->ixy', mass, r, r)
+    # angular momentum and angular velocity
+    ang_mom = numpy.einsum('a,iax->ix', mass, numpy.cross(r, veloc))
+    invertible = numpy.linalg.det(I) > 0.01
+    if not invertible.all():
+      print 'WARNING: moment of inertia tensor is not invertible'
+    ang_vel = numpy.zeros_like(ang_mom)
+    if invertible.any():
+      ang_vel[invertible] = numpy.linalg.solve(I[invertible], ang_mom[invertible][:,:,None])[:,:,0]
+    veloc = veloc - numpy.cross(ang_vel[:,None,:], r)
+    return coord, veloc
+
 def constrain_displacement(molecule, ic, threshold=0.5):
     """This function ensures, that each atom of a generated initial
 condition is not displaced further, than a given threshold from its
@@ -1033,63 +1189,76 @@ original position. Threshold is given in bohr."""
                 ic[i]['coords'][xyz] = atom.coord[xyz] \
                                        + diff_vector[xyz]
 
+def transform_normal_modes(modes, molecule, nmodes):
+  '''This function applies the four possible transformations to mass-weighted
+coordinates to all normal modes at once. Returns a (4, nmodes, natom, 3) array of
+the transformed displacements.'''
+  natom = len(molecule)
+  move = numpy.array([ mode['move'] for mode in modes ], dtype=float).reshape(nmodes, natom, 3)
+  mass = numpy.array([ atom.mass/U_TO_AMU for atom in molecule ])[None,:,None]
+  norm = numpy.sqrt(numpy.sum(move**2 * mass, axis=(1,2)))
+  for imode in numpy.nonzero(norm == 0.0)[0]:
+    if modes[imode]['freq']>=LOW_FREQ*CM_TO_HARTREE:
+      print 'WARNING: Displacement vector of mode %i is null vector. Ignoring this mode!' % (imode+1)
+      modes[imode]['freq']=0.0
+  norm[norm == 0.0] = 1.0
+  moves = numpy.array([ move / (norm[:,None,None]/numpy.sqrt(mass)),
+                        move * numpy.sqrt(mass),
+                        move * numpy.sqrt(mass)/math.sqrt(ANG_TO_BOHR),
+                        move ])
+  return moves
+
 def determine_normal_modes_format(modes, molecule, nmodes, flag):
   '''This function determines the input format of the normal modes by trying to
 transform them to mass-weighted coordinates and seeing which of the four methods
 was able to do so via checking if the normal modes are now orthogonal. The mass-
-weighted normal coordinates are then returned'''
+weighted normal coordinates are then returned, together with the format specifier
+that was used.'''
 
   print '\nStarting normal mode format determination...'
 
-  #generate different set of modes that each undergo a different transformation
-  #modes_1, modes_2, modes_3 and modes are represented by the numbers 1, 2, 3
-  #and 4, where 1 stands for gaussian-type coordinates, 2 for cartesian coordinates,
+  #the transformations are represented by the numbers 1, 2, 3 and 4, 
+  #where 1 stands for gaussian-type coordinates, 2 for cartesian coordinates,
   #3 for Colombus-type coordinates and 4 for already mass-weighted coordinates.
-  modes_1 = copy.deepcopy(modes)
-  modes_2 = copy.deepcopy(modes)
-  modes_3 = copy.deepcopy(modes)
-  allmodes = [modes_1,modes_2,modes_3,modes]
   normformat = ["gaussian-type (Gaussian, Turbomole, Q-Chem, ADF, Orca)","cartesian (Molpro, Molcas)","columbus-type (Columbus)","mass-weighted"]
 
-  #apply transformations to normal modes
-  for imode in range(nmodes):
-    norm = 0.0
-    for j, atom in enumerate(molecule):
-      for xyz in range(3):
-        norm += modes_2[imode]['move'][j][xyz]**2*atom.mass/U_TO_AMU
-    norm = math.sqrt(norm)
-    if norm == 0.0 and modes[imode]['freq']>=LOW_FREQ*CM_TO_HARTREE:
-      print 'WARNING: Displacement vector of mode %i is null vector. Ignoring this mode!' % (imode+1)
-      for normmodes in allmodes:
-        normmodes[imode]['freq']=0.0
-    for j, atom in enumerate(molecule):
-      for xyz in range(3):
-        modes_1[imode]['move'][j][xyz] /= norm/math.sqrt(atom.mass/U_TO_AMU)
-        modes_2[imode]['move'][j][xyz] *= math.sqrt(atom.mass/U_TO_AMU)
-        modes_3[imode]['move'][j][xyz] *= math.sqrt(atom.mass/U_TO_AMU)/math.sqrt(ANG_TO_BOHR)
+  if np:
+    moves = transform_normal_modes(modes, molecule, nmodes)
+    allmodes = [ [ dict(mode, move=moves[nr,imode].tolist()) for imode, mode in enumerate(modes) ] for nr in range(4) ]
+  else:
+    #generate different set of modes that each undergo a different transformation
+    modes_1 = copy.deepcopy(modes)
+    modes_2 = copy.deepcopy(modes)
+    modes_3 = copy.deepcopy(modes)
+    allmodes = [modes_1,modes_2,modes_3,modes]
+
+    #apply transformations to normal modes
+    for imode in range(nmodes):
+      norm = 0.0
+      for j, atom in enumerate(molecule):
+        for xyz in range(3):
+          norm += modes_2[imode]['move'][j][xyz]**2*atom.mass/U_TO_AMU
+      norm = math.sqrt(norm)
+      if norm == 0.0 and modes[imode]['freq']>=LOW_FREQ*CM_TO_HARTREE:
+        print 'WARNING: Displacement vector of mode %i is null vector. Ignoring this mode!' % (imode+1)
+        for normmodes in allmodes:
+          normmodes[imode]['freq']=0.0
+      for j, atom in enumerate(molecule):
+        for xyz in range(3):
+          modes_1[imode]['move'][j][xyz] /= norm/math.sqrt(atom.mass/U_TO_AMU)
+          modes_2[imode]['move'][j][xyz] *= math.sqrt(atom.mass/U_TO_AMU)
+          modes_3[imode]['move'][j][xyz] *= math.sqrt(atom.mass/U_TO_AMU)/math.sqrt(ANG_TO_BOHR)
   if flag != 0:
     print "Using input flag",flag, "for", normformat[flag-1],"coordinates. Skipping normal mode analysis. "
-    return allmodes[flag-1]
+    return allmodes[flag-1], flag
 
   elif int(flag) <= 4:
     #create dotproduct matrices of the normal mode multiplication
     #for all three transformations.
     if np:
-      matrix = [[] for i in range(4)]
-      for coord in range(len(molecule)):
-        for xyz in range(3):
-          displacement = [[] for i in range(4)]
-          for mode in range(nmodes):
-            for nr in range(len(allmodes)):
-              displacement[nr].append(allmodes[nr][mode]['move'][coord][xyz])
-          for nr in range(len(allmodes)):
-            matrix[nr].append(displacement[nr])
-      newmatrix = [[] for i in range(4)]
-      results = [[] for i in range(4)]
-      for nr in range(len(allmodes)):
-        newmatrix[nr] = numpy.array(matrix[nr])
-        results[nr] = numpy.dot(newmatrix[nr].T,newmatrix[nr])
-
+      #stacked (4, 3N, nmodes) matrices of the transformed normal modes
+      stacked = moves.reshape(4, nmodes, 3*len(molecule)).transpose(0,2,1)
+      results = numpy.matmul(stacked.transpose(0,2,1), stacked)
     else:
       #do the slow matrix multiplication of every normal mode with every other
       #this approach is approximately 25 times slower than the numpy approach
@@ -1109,22 +1278,27 @@ weighted normal coordinates are then returned'''
     #check for orthogonal matrices
     diagonalcheck = [[],[]]
     thresh = 0.05
-    for result in results:
-      trace = 0
-      for i in range(len(result)):
-        trace += result[i][i]
-        result[i][i] -= 1
-      diagonalcheck[0].append(trace)
-      #print all matrices
-      #for row in result:
-        #string = ''
-        #for entry in row:
-        #  string += "%4.1f" % (float(entry))
-        #print string
-      if any( [abs(i) > thresh for j in result for i in j ] ):
-        diagonalcheck[1].append(0)
-      else:
-        diagonalcheck[1].append(1)
+    if np:
+      diagonalcheck[0] = numpy.trace(results, axis1=1, axis2=2).tolist()
+      deviation = numpy.abs(results - numpy.eye(nmodes)).reshape(4, -1)
+      diagonalcheck[1] = [ int(not (row > thresh).any()) for row in deviation ]
+    else:
+      for result in results:
+        trace = 0
+        for i in range(len(result)):
+          trace += result[i][i]
+          result[i][i] -= 1
+        diagonalcheck[0].append(trace)
+        #print all matrices
+        #for row in result:
+          #string = ''
+          #for entry in row:
+          #  string += "%4.1f" % (float(entry))
+          #print string
+        if any( [abs(i) > thresh for j in result for i in j ] ):
+          diagonalcheck[1].append(0)
+        else:
+          diagonalcheck[1].append(1)
     possibleflags = []
     for i in range(4):
       if diagonalcheck[0][i] > nmodes-1 and diagonalcheck[0][i]/nmodes-1 < thresh and diagonalcheck[1][i] == 1:
@@ -1155,13 +1329,64 @@ weighted normal coordinates are then returned'''
     else:
       print "The normal modes input format was determined to be %s coordinates." % (normformat[nm_flag])
     #return the set of transformed normal modes that resulted in an orthogonal matrix (mass-weighted)
-    return allmodes[nm_flag]
+    return allmodes[nm_flag], nm_flag+1
   else:
     print "Wrong input, please specify a valid flag [0,1,2,3,4]!"
     quit(1)
 
 
 
+def draw_QP(mode):
+  """This function draws a single accepted pair of dimensionless coordinate Q 
+and momentum P of a mode by rejection sampling of the Wigner distribution."""
+  while True:
+    # get random Q and P in the interval [-5,+5]
+    # this interval is good for vibrational ground state
+    # should be increased for higher states
+    # TODO: needs to be restructured: first obtain temperature, then draw random numbers, then compute wigner probability
+    random_Q = random.random()*10.0 - 5.0
+    random_P = random.random()*10.0 - 5.0
+    # calculate probability for this set of P and Q with Wigner distr.
+    probability = wigner(random_Q, random_P, mode)
+    if probability[0]>1. or probability[0]<0.:
+      if temperature == 0:
+        print 'WARNING: wrong probability %f detected!' % (probability[0])
+    elif probability[0] > random.random():
+      return random_Q, random_P # coordinates accepted
+
+def draw_QP_batch(mode, amount):
+  """This function draws amount pairs of dimensionless coordinates Q and 
+momenta P of a mode at once, from the same distribution as draw_QP. In the 
+vibrational ground state at zero temperature, the Wigner distribution 
+exp(-Q**2)*exp(-P**2) is a product of two Gaussians with a variance of 1/2, 
+from which Q and P are drawn directly. At finite temperature, all pairs are 
+obtained by rejection sampling, where as in draw_QP every trial draws its own
+vibrational state. Rejected pairs are drawn again until every pair has been
+accepted."""
+  if temperature == 0:
+    Q = numpy.random.normal(0., math.sqrt(0.5), amount)
+    P = numpy.random.normal(0., math.sqrt(0.5), amount)
+    return Q, P
+  Q = numpy.zeros(amount)
+  P = numpy.zeros(amount)
+  todo = numpy.arange(amount)
+  while len(todo) > 0:
+    # get random Q and P in the interval [-5,+5]
+    random_Q = numpy.random.random(len(todo))*10.0 - 5.0
+    random_P = numpy.random.random(len(todo))*10.0 - 5.0
+    n = vibrational_states(mode, len(todo))
+    rhosquare = 2.0 * (random_P**2 + random_Q**2)
+    # discarded states (-1) have a negative probability, as in wigner
+    probability = -numpy.ones(len(todo))
+    for state in numpy.unique(n[n >= 0]):
+      trials = numpy.nonzero(n == state)[0]
+      probability[trials] = (-1.0)**state * ana_laguerre(state, rhosquare[trials]) * numpy.exp(-rhosquare[trials]/2.0)
+    accepted = (probability >= 0.) & (probability <= 1.) & (probability > numpy.random.random(len(todo)))
+    Q[todo[accepted]] = random_Q[accepted]
+    P[todo[accepted]] = random_P[accepted]
+    todo = todo[~accepted]
+  return Q, P
+
 def sample_initial_condition(molecule, modes):
   """This function samples a single initial condition from the
 modes and atomic coordinates by the use of a Wigner distribution.
@@ -1176,20 +1401,7 @@ Method is based on L. Sun, W. L. Hase J. Chem. Phys. 133, 044313
   for atom in atomlist:
     atom.veloc = [0.0, 0.0, 0.0] # initialise velocity lists
   for mode in modes: # for each uncoupled harmonatomlist oscillator
-    while True:
-      # get random Q and P in the interval [-5,+5]
-      # this interval is good for vibrational ground state
-      # should be increased for higher states
-      # TODO: needs to be restructured: first obtain temperature, then draw random numbers, then compute wigner probability
-      random_Q = random.random()*10.0 - 5.0
-      random_P = random.random()*10.0 - 5.0
-      # calculate probability for this set of P and Q with Wigner distr.
-      probability = wigner(random_Q, random_P, mode)
-      if probability[0]>1. or probability[0]<0.:
-        if temperature == 0:
-          print 'WARNING: wrong probability %f detected!' % (probability[0])
-      elif probability[0] > random.random():
-        break # coordinates accepted
+    random_Q, random_P = draw_QP(mode)
     # now transform the dimensionless coordinate into a real one
     # paper says, that freq_factor is sqrt(2*PI*freq)
     # QM programs directly give angular frequency (2*PI is not needed)
@@ -1218,6 +1430,41 @@ Method is based on L. Sun, W. L. Hase J. Chem. Phys. 133, 044313
   ic = INITCOND(atomlist,0.,Epot)
   return ic
 
+def sample_initial_conditions_batch(amount, molecule, modes, legacy=False):
+  """This function samples amount initial conditions at once. The geometries
+and velocities are obtained for all initial conditions from a single product 
+of the (amount, nmodes) matrices of Q and P with the (nmodes, 3*natom) matrix
+of the unweighted normal modes. Returns the coordinates and velocities as 
+(amount, natom, 3) arrays and the harmonic potential energies. 
+With legacy, the pairs are drawn one after another in the same order as in 
+sample_initial_condition, so that a given seed reproduces the same draws."""
+  natom = len(molecule)
+  nmodes = len(modes)
+  Q = numpy.zeros((amount, nmodes))
+  P = numpy.zeros((amount, nmodes))
+  if legacy:
+    for i in range(amount):
+      for j, mode in enumerate(modes):
+        Q[i,j], P[i,j] = draw_QP(mode)
+  else:
+    for j, mode in enumerate(modes):
+      Q[:,j], P[:,j] = draw_QP_batch(mode, amount)
+  # transform the dimensionless coordinates into real ones
+  freq = numpy.array([ mode['freq'] for mode in modes ])
+  Q /= numpy.sqrt(freq)
+  P *= numpy.sqrt(freq)
+  Epot = 0.5 * numpy.sum(freq**2 * Q**2, axis=1)
+  # unweigh the mass-weighted normal modes
+  mass = numpy.array([ atom.mass for atom in molecule ])
+  move = numpy.array([ mode['move'] for mode in modes ]).reshape(nmodes, 3*natom) / numpy.repeat(numpy.sqrt(mass), 3)
+  coord = numpy.tile(numpy.array([ atom.coord for atom in molecule ]).reshape(1, 3*natom), (amount, 1))
+  veloc = numpy.zeros((amount, 3*natom))
+  if not UEG:
+    coord += numpy.dot(Q, move)
+  if not UZV:
+    veloc += numpy.dot(P, move)
+  return coord.reshape(amount, natom, 3), veloc.reshape(amount, natom, 3), Epot
+
 # ======================================================================================================================
 # ======================================================================================================================
 # ======================================================================================================================
@@ -1255,10 +1502,11 @@ Method is based on L. Sun, W. L. Hase J. Chem. Phys. 133, 044313
 
 # ======================================================================================================================
 
-def create_initial_conditions_string(molecule, modes, ic_list, eref=0.0):
-  """This function converts an list of initial conditions into a string."""
-  ninit=len(ic_list)
-  natom=ic_list[0].natom
+def initial_conditions_strings(molecule, modes, ic_iter, ninit, eref=0.0):
+  """This generator yields the initconds file piece by piece: the header with
+the equilibrium geometry and then the block of each initial condition taken 
+from ic_iter, so that the conditions can be written while they are sampled."""
+  natom=len(molecule)
   representation='None'
   #eref
   eharm=0.
@@ -1277,51 +1525,103 @@ Equilibrium
   for atom in molecule:
     string+=str(atom)+'\n'
   string+='\n\n'
+  yield string
 
-  for i, ic in enumerate(ic_list):
-    string += 'Index     %i\n%s' % (i+1, str(ic))
-  return string
+  for i, ic in enumerate(ic_iter):
+    yield 'Index     %i\n%s' % (i+1, str(ic))
+
+def create_initial_conditions_string(molecule, modes, ic_list, eref=0.0):
+  """This function converts an list of initial conditions into a string."""
+  return ''.join(initial_conditions_strings(molecule, modes, ic_list, len(ic_list), eref))
+
+def write_initial_conditions(filename, molecule, modes, ic_iter, ninit, eref=0.0, sidecar=False):
+  """This function streams the ninit initial conditions of ic_iter into the 
+initconds file filename and, if sidecar is set, adds its binary sidecar."""
+  f=open(filename, 'w', 1<<16)
+  if sidecar:
+    sidecar=mod_initconds.open_sidecar(filename, ninit, [ str(atom) for atom in molecule ])
+  for i, string in enumerate(initial_conditions_strings(molecule, modes, ic_iter, ninit, eref)):
+    f.write(string)
+    if sidecar and i>0:
+      # the sidecar is filled from the text block of condition i
+      sidecar.add(i, string.split('\n',1)[1])
+  f.close()
+  if sidecar:
+    sidecar.close()
 
 # ======================================================================================================================
 
 
-def create_initial_conditions_list(amount, molecule, modes):
-    """This function creates 'amount' initial conditions from the
-data given in 'molecule' and 'modes'. Output is returned
-as a list containing all initial condition objects."""
+
+def iterate_initial_conditions(amount, molecule, modes, legacy=False, chunk=10000):
+    """This generator creates 'amount' initial conditions from the
+data given in 'molecule' and 'modes' and yields them one by one. 
+They are sampled in batches of at most chunk initial conditions,
+so that the memory does not grow with amount."""
     print 'Sampling initial conditions'
-    ic_list = []
     width = 50
     idone = 0
-    for i in range(1,amount+1): # for each requested initial condition
+    for start in range(0, amount, chunk):
+      nbatch = min(chunk, amount-start)
+      if np:
+        coords, velocs, Epots = sample_initial_conditions_batch(nbatch, molecule, modes, legacy)
+        if not KTR and not legacy:
+          mass = numpy.array([ atom.mass for atom in molecule ])
+          new_coords, new_velocs = remove_rigid_body_motion(coords, velocs, mass, get_center_of_mass(molecule))
+      for i in range(nbatch): # for each requested initial condition
         # sample the initial condition
-        ic = sample_initial_condition(molecule, modes)
-        ic_list.append(ic)
+        if np:
+          atomlist = [ ATOM(atom.symb, atom.num, coords[i,j].tolist(), atom.mass, velocs[i,j].tolist()) for j, atom in enumerate(molecule) ]
+          if not KTR and legacy:
+            # the previous per-atom removal reproduces the previous initial conditions
+            restore_center_of_mass(molecule, atomlist)
+            remove_translations(atomlist, legacy)
+            remove_rotations(atomlist, legacy)
+          elif not KTR:
+            # the kinetic energy is given before the removal, as in sample_initial_condition
+            for j, atom in enumerate(atomlist):
+              atom.coord = new_coords[i,j].tolist()
+              atom.veloc = new_velocs[i,j].tolist()
+          ic = INITCOND(atomlist,0.,Epots[i])
+        else:
+          ic = sample_initial_condition(molecule, modes)
         idone += 1
         done = idone*width/(amount)
         sys.stdout.write('\rProgress: ['+'='*done+' '*(width-done)+'] %3i%%' % (done*100/width))
         sys.stdout.flush()
+        yield ic
     print '\n'
-    return ic_list
+
+def create_initial_conditions_list(amount, molecule, modes, legacy=False):
+    """This function creates 'amount' initial conditions from the
+data given in 'molecule' and 'modes'. Output is returned
+as a list containing all initial condition objects."""
+    return list(iterate_initial_conditions(amount, molecule, modes, legacy))
 
 # ======================================================================================================================
 
-def make_dyn_file(ic_list,filename):
+def dyn_file_writer(ic_iter,filename):
+  """This generator writes the geometries of the initial conditions of ic_iter
+to filename in xyz format while passing them on."""
   #if not os.path.exists('init_geoms'):
     #os.mkdir('init_geoms')
   #for state in range(states):
   fl=open(filename,'w')
-  string=''
-  for i,ic in enumerate(ic_list):
-    string+='%i\n%i\n' % (ic.natom,i)
+  for i,ic in enumerate(ic_iter):
+    string='%i\n%i\n' % (ic.natom,i)
     for atom in ic.atomlist:
       string+='%s' % (atom.symb)
       for j in range(3):
         string+=' %f' % (atom.coord[j]/ANG_TO_BOHR)
       string+='\n'
-  fl.write(string)
+    fl.write(string)
+    yield ic
   fl.close()
 
+def make_dyn_file(ic_list,filename):
+  for ic in dyn_file_writer(ic_list,filename):
+    pass
+
 # ======================================================================================================================
 
 def lvc_input(molecule, modes):
@@ -1360,6 +1660,46 @@ def lvc_input(molecule, modes):
           wf.write('\n')
     wf.close()
 
+# ======================================================================================================================
+
+def load(filename, scaling=1.0, flag=0, low_freq=10.0):
+  '''Reads molecule and normal modes from a MOLDEN file, for the use of this
+module from other scripts (e.g. the SHARC gym) without starting a new process.
+Each mode carries its number in the MOLDEN file as 'nr', so the same molecule
+and modes can be used to sample initial conditions for different subsets of
+modes.'''
+  global LOW_FREQ
+  LOW_FREQ=max(0.0000001,low_freq)
+  global whichatoms
+  whichatoms=[]
+  return import_from_molden(filename, scaling, flag)
+
+# ======================================================================================================================
+
+def sample(molecule, modes, amount, outfile='initconds', seed=16661, delete_modes=[], temp=0., discard_high=False, keep_trans_rot=False, use_eq_geom=False, use_zero_veloc=False, legacy=False, sidecar=False):
+  '''Samples amount initial conditions and writes them to outfile, in the same
+way as running this script on the MOLDEN file would do. Modes whose number is in
+delete_modes are not sampled, which is the same as setting their frequency to 
+zero in the MOLDEN file. With sidecar, the binary sidecar of outfile is written
+as well.'''
+  global temperature
+  temperature=temp
+  global high_temp
+  high_temp=discard_high
+  global KTR
+  KTR=keep_trans_rot
+  global UEG
+  UEG=use_eq_geom
+  global UZV
+  UZV=use_zero_veloc
+
+  modes=[ mode for mode in modes if not mode['nr'] in delete_modes ]
+  random.seed(seed)
+  if np:
+    numpy.random.seed(seed)
+  ic_iter = iterate_initial_conditions(amount, molecule, modes, legacy)
+  write_initial_conditions(outfile, molecule, modes, ic_iter, amount, sidecar=sidecar)
+
 # ======================================================================================================================
 # ======================================================================================================================
 # ======================================================================================================================
@@ -1396,15 +1736,20 @@ as described in [2] (non-fixed energy, independent mode sampling).
   parser.add_option('-l', dest='lvc', action='store_true', help='Generate input for SHARC_LVC.py (V0.txt) rather than initconds')
 
   parser.add_option('-r', dest='r', type=int, nargs=1, default=16661, help="Seed for the random number generator (integer, default=16661)")
+  parser.add_option('--legacy_draws', dest='legacy', action='store_true', help="Draw the random numbers one after another and remove translations and rotations as in previous versions, which reproduces their initial conditions for a given seed")
   parser.add_option('-f', dest='f', type=int, nargs=1, default='0', help="Define the type of read normal modes. 0 for automatic assignement, 1 for gaussian-type normal modes (Gaussian, Turbomole, Q-Chem, ADF, Orca), 2 for cartesian normal modes (Molcas, Molpro), 3 for Columbus-type (Columbus), or 4 for mass-weighted. (integer, default=0)")
   
   parser.add_option('--keep_trans_rot', dest='KTR', action='store_true',help="Keep translational and rotational components")
   parser.add_option('--use_eq_geom',    dest='UEG', action='store_true',help="For all samples, use the equilibrium geometry (only sample velocities)")
   parser.add_option('--use_zero_veloc', dest='UZV', action='store_true',help="For all samples, set velocities to zero")
+  parser.add_option('--sidecar', dest='sidecar', action='store_true',help="Also write the binary sidecar <output>.sidecar, from which the setup scripts read the initial conditions without parsing the text file")
+  parser.add_option('--cache', dest='cache', type=str, nargs=1, default=None, help="Directory in which the parsed MOLDEN file and its normal mode format are kept for later runs (string, default: no cache)")
   
   (options, args) = parser.parse_args()
 
   random.seed(options.r)
+  if np:
+    numpy.random.seed(options.r)
   amount=options.n
   if len(args)==0:
     print usage
@@ -1417,6 +1762,8 @@ as described in [2] (non-fixed energy, independent mode sampling).
   lvc = options.lvc
   global LOW_FREQ
   LOW_FREQ=max(0.0000001,options.L)
+  global CACHE_DIR
+  CACHE_DIR=options.cache
 
   print '''Initial condition generation started...
 INPUT  file                  = "%s"
@@ -1476,15 +1823,11 @@ Temperature                  = %f''' % (filename, outfile, options.n, options.r,
       lvc_input(molecule, modes)
   else:
       #print 'Generating %i initial conditions' % amount
-      ic_list = create_initial_conditions_list(amount, molecule, modes)
+      ic_iter = iterate_initial_conditions(amount, molecule, modes, options.legacy)
+      if options.X:
+        ic_iter = dyn_file_writer(ic_iter,options.o+'.xyz')
       #print 'Writing output to initconds'
-      outfile = open(outfile, 'w')
-      outstring = create_initial_conditions_string(molecule, modes, ic_list)
-      outfile.write(outstring)
-      outfile.close()
-
-  if options.X and not options.lvc:
-    make_dyn_file(ic_list,options.o+'.xyz')
+      write_initial_conditions(outfile, molecule, modes, ic_iter, amount, sidecar=options.sidecar)
 
   # save the shell command
   command='python '+' '.join(sys.argv)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python2
+
+#******************************************
+#
+#    SHARC-GYM
+#
+#    Copyright (c) 2020 University of Vienna
+#
+#    This file is part of the SHARC-GYM.
+#
+#    SHARC-GYM is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SHARC-GYM is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    from the git repository.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************
+
+# Tests of the Wigner sampling and of the removal of translations and rotations
+# of mod_wigner.py
+#
+# usage python2 -m unittest discover tests
+
+import os
+import sys
+import math
+import random
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import mod_wigner
+import check_rigid_body_motion
+
+# ======================================================================= #
+
+def ks_statistic(a, b):
+  #largest distance of the empirical distribution functions of two samples
+  a = numpy.sort(a)
+  b = numpy.sort(b)
+  x = numpy.concatenate((a, b))
+  cdf_a = numpy.searchsorted(a, x, side='right')/float(len(a))
+  cdf_b = numpy.searchsorted(b, x, side='right')/float(len(b))
+  return numpy.max(numpy.abs(cdf_a-cdf_b))
+
+# ======================================================================= #
+
+class TestDrawQP(unittest.TestCase):
+  '''The batched draws of draw_QP_batch follow the same distribution as the
+  single draws of draw_QP.'''
+
+  N = 4000
+
+  def setUp(self):
+    self.temperature = getattr(mod_wigner, 'temperature', 0.)
+    mod_wigner.high_temp = False
+    random.seed(16661)
+    numpy.random.seed(16661)
+
+  def tearDown(self):
+    mod_wigner.temperature = self.temperature
+
+  def compare(self, freq, temperature):
+    mod_wigner.temperature = temperature
+    mode = {'freq': freq*mod_wigner.CM_TO_HARTREE}
+    scalar = numpy.array([ mod_wigner.draw_QP(mode) for i in range(self.N) ])
+    Q, P = mod_wigner.draw_QP_batch(mode, self.N)
+    batch = numpy.array([Q, P]).T
+    # critical value of the two-sample Kolmogorov-Smirnov test at 0.1% significance
+    critical = 1.95*math.sqrt(2./self.N)
+    for a, b in [ (scalar[:,0], batch[:,0]), (scalar[:,1], batch[:,1]), (numpy.sum(scalar**2, axis=1), numpy.sum(batch**2, axis=1)) ]:
+      self.assertLess(ks_statistic(a, b), critical)
+      error = math.sqrt((numpy.var(a)+numpy.var(b))/self.N)
+      self.assertLess(abs(numpy.mean(a)-numpy.mean(b)), 5.*error)
+
+  def test_zero_temperature(self):
+    self.compare(500., 0.)
+
+  def test_finite_temperature(self):
+    #many excited states are populated, whose Wigner functions are partly negative
+    self.compare(200., 1000.)
+
+class TestRigidBodyMotion(unittest.TestCase):
+  '''The batched projection remove_rigid_body_motion gives the same coordinates
+  and velocities as the per-atom loops.'''
+
+  def compare(self, amount, natom):
+    molecule, mass, coord, veloc = check_rigid_body_motion.random_batch(amount, natom, 16661)
+    loop = check_rigid_body_motion.per_atom(molecule, coord, veloc)
+    batch = mod_wigner.remove_rigid_body_motion(coord, veloc, mass, mod_wigner.get_center_of_mass(molecule))
+    for a, b in zip(loop, batch):
+      self.assertLess(numpy.max(numpy.abs(a-b)), 1e-10*numpy.max(numpy.abs(a)))
+
+  def test_small_molecule(self):
+    self.compare(200, 3)
+
+  def test_large_molecule(self):
+    self.compare(50, 30)
+
+# ======================================================================= #
+
+if __name__ == '__main__':
+  unittest.main()
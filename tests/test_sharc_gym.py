@@ -0,0 +1,119 @@
+#!/usr/bin/env python2
+
+#******************************************
+#
+#    SHARC-GYM
+#
+#    Copyright (c) 2020 University of Vienna
+#
+#    This file is part of the SHARC-GYM.
+#
+#    SHARC-GYM is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SHARC-GYM is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    from the git repository.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************
+
+# Tests of the LVC model handling of SHARC_gym.py
+#
+# usage python2 -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import SHARC_gym
+
+# ======================================================================= #
+
+class TestFingerprint(unittest.TestCase):
+
+  HEAD = 'V0.txt\n2\n'
+  TEMPLATE = '''epsilon
+2
+  1   1  0.0
+  1   2  0.1
+kappa
+2
+  1   1     7  3.0e-03
+  1   2     8  4.0e-03
+lambda
+2
+  1   1   2   7  2.0e-03
+  1   1   2   8  5.0e-03
+'''
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def fingerprint(self, text):
+    filename = os.path.join(self.tmpdir, 'LVC.template')
+    f = open(filename, 'w')
+    f.write(self.HEAD+text)
+    f.close()
+    return SHARC_gym.fingerprint_hamiltonian(SHARC_gym.LVCModel().read(filename), 1e-6)
+
+  def test_relative_sign(self):
+    #flipping the sign of a single coupling changes the physics
+    flipped = self.TEMPLATE.replace('8  5.0e-03', '8 -5.0e-03')
+    self.assertNotEqual(self.fingerprint(self.TEMPLATE), self.fingerprint(flipped))
+
+  def test_state_sign(self):
+    #flipping the sign of a state changes all of its couplings at once
+    flipped = self.TEMPLATE.replace('8  5.0e-03', '8 -5.0e-03').replace('7  2.0e-03', '7 -2.0e-03')
+    self.assertEqual(self.fingerprint(self.TEMPLATE), self.fingerprint(flipped))
+
+  def test_numbering(self):
+    #the same model with the two states interchanged
+    swapped = self.TEMPLATE.replace('1   1  0.0', '1   1  0.1').replace('1   2  0.1', '1   2  0.0')
+    swapped = swapped.replace('1   1     7', '1   2     7').replace('1   2     8', '1   1     8')
+    self.assertEqual(self.fingerprint(self.TEMPLATE), self.fingerprint(swapped))
+
+# ======================================================================= #
+
+class TestTemplate(unittest.TestCase):
+
+  TESTCASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testcase', 'LVC.template')
+
+  def test_round_trip(self):
+    #the reference template is written back unchanged
+    f = open(self.TESTCASE)
+    text = f.read()
+    f.close()
+    self.assertEqual(str(SHARC_gym.LVCModel().read(self.TESTCASE)), text)
+
+  def test_reduced_values(self):
+    #a reduction that keeps everything only changes the formatting, not the values
+    hamiltonian = SHARC_gym.LVCModel().read(self.TESTCASE)
+    states = [ range(1, n+1) for n in hamiltonian.states ]
+    reduced = SHARC_gym.reduce_hamiltonian(hamiltonian, hamiltonian.used_modes, states)
+    tmpdir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(tmpdir, 'LVC.template')
+      SHARC_gym.write_hamiltonian(reduced, filename)
+      f = open(filename)
+      lines = f.readlines()
+      f.close()
+    finally:
+      shutil.rmtree(tmpdir)
+    self.assertEqual([ line.split() for line in lines ], [ line.split() for line in hamiltonian.lines ])
+
+# ======================================================================= #
+
+if __name__ == '__main__':
+  unittest.main()